@@ -70,7 +70,7 @@ def draft_changelog(
     prerelease = util.is_prerelease(version)
     tag_name = tag_format.format(version=version)
 
-    current_sha = util.run("git rev-parse HEAD")
+    current_sha = util.get_head_sha()
 
     # Check for multiple versions
     npm_versions = None
@@ -335,25 +335,22 @@ def extract_release(auth, dist_dir, dry_run, release_url):
         shutil.rmtree(dist, ignore_errors=True)
     os.makedirs(dist)
 
-    # Fetch, validate, and publish assets
+    # Fetch the shas first so that each asset is validated as it is fetched
+    asset_shas = None
     for asset in assets:
-        util.fetch_release_asset(dist_dir, asset, auth)
-
-    # Validate the shas of all the files
-    asset_shas_file = dist / "asset_shas.json"
-    with open(asset_shas_file) as fid:
-        asset_shas = json.load(fid)
-    asset_shas_file.unlink()
+        if asset.name == "asset_shas.json":
+            asset_shas = util.fetch_release_asset_data(asset, auth)
+    if asset_shas is None:
+        msg = "asset_shas.json was not found in the release"
+        raise ValueError(msg)
 
+    # Fetch and validate the assets
+    assets = [asset for asset in assets if asset.name != "asset_shas.json"]
     for asset in assets:
-        if asset.name.endswith(".json"):
-            continue
-        if asset.name not in asset_shas:
+        if not asset.name.endswith(".json") and asset.name not in asset_shas:
             msg = f"{asset.name} was not found in asset_shas file"
             raise ValueError(msg)
-        if util.compute_sha256(dist / asset.name) != asset_shas[asset.name]:
-            msg = f"sha for {asset.name} does not match asset_shas file"
-            raise ValueError(msg)
+    util.fetch_release_assets(dist_dir, assets, auth, asset_shas)
 
     os.chdir(orig_dir)
 
@@ -544,7 +541,9 @@ def prep_git(ref, branch, repo, auth, username, url):
         ref = None
 
     # Handle the branch.
-    branch = branch or util.get_default_branch()
+    default_branch = None
+    if not branch:
+        branch = default_branch = util.get_default_branch()
 
     # Reuse existing branch if possible
     if ref:
@@ -554,6 +553,9 @@ def prep_git(ref, branch, repo, auth, username, url):
     else:
         util.run(f"{util.GIT_FETCH_CMD} {branch}")
         checkout_cmd = f"git checkout {branch}"
+        # Record the default branch so later commands can resolve it locally.
+        if default_branch:
+            util.run(f"git remote set-head origin {default_branch}")
 
     if checkout_exists:
         try:
@@ -1,5 +1,6 @@
 """A mock GitHub API implementation."""
 import atexit
+import hashlib
 import json
 import os
 import tempfile
@@ -7,7 +8,7 @@ import uuid
 from datetime import datetime, timezone
 from typing import Dict, List
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 
@@ -57,6 +58,23 @@ def write_to_file(name, data):
         json.dump(result, fid)
 
 
+@app.middleware("http")
+async def add_etag(request: Request, call_next):
+    """Add an ETag to API responses and answer matching conditional requests."""
+    response = await call_next(request)
+    if request.method != "GET" or not request.url.path.startswith("/repos/"):
+        return response
+    if response.status_code != 200:
+        return response
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    etag = '"%s"' % hashlib.sha256(body).hexdigest()
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    headers = dict(response.headers)
+    headers["ETag"] = etag
+    return Response(body, status_code=200, headers=headers, media_type=response.media_type)
+
+
 class Asset(BaseModel):
     """An asset model."""
 
@@ -140,15 +158,28 @@ def read_root():
 
 
 @app.get("/repos/{owner}/{repo}/releases")
-def list_releases(owner: str, repo: str) -> List[Release]:
+def list_releases(owner: str, repo: str, per_page: int = 30, page: int = 1) -> List[Release]:
     """https://docs.github.com/en/rest/releases/releases#list-releases"""
-    return list(releases.values())
+    # Releases are listed newest first.
+    start = (page - 1) * per_page
+    return list(reversed(releases.values()))[start : start + per_page]
 
 
 @app.get("/repos/{owner}/{repo}/releases/tags/{tag}")
 def get_release_by_tag(owner: str, repo: str, tag: str) -> Release:
     """https://docs.github.com/en/rest/releases/releases#get-a-release-by-tag-name"""
-    return next(filter(lambda r: r.tag_name == tag, releases.values()))
+    for release in releases.values():
+        if release.tag_name == tag:
+            return release
+    raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.get("/repos/{owner}/{repo}/releases/{release_id}")
+def get_a_release(owner: str, repo: str, release_id: int) -> Release:
+    """https://docs.github.com/en/rest/releases/releases#get-a-release"""
+    if str(release_id) not in releases:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return releases[str(release_id)]
 
 
 @app.post("/repos/{owner}/{repo}/releases")
@@ -5,6 +5,7 @@
 import json
 import os
 import os.path as osp
+import re
 import shutil
 import tarfile
 from glob import glob
@@ -14,6 +15,9 @@ from tempfile import TemporaryDirectory
 from jupyter_releaser import util
 
 PACKAGE_JSON = util.PACKAGE_JSON
+SEMVER_PATTERN = re.compile(
+    r"(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)(-[0-9A-Za-z.-]+)?(\+[0-9A-Za-z.-]+)?"
+)
 
 
 # Python 3.12+ gives a deprecation warning if TarFile.extraction_filter is None.
@@ -31,7 +35,7 @@ def build_dist(package, dist_dir):
         os.remove(pkg)
 
     if osp.isdir(package):
-        tarball = osp.join(package, util.run("npm pack", cwd=package).split("\n")[-1])
+        tarball = osp.join(package, util.run("npm pack", cwd=package, tail=1))
     else:
         tarball = package
 
@@ -55,7 +59,9 @@ def build_dist(package, dist_dir):
                 continue
             paths.append(str(osp.abspath(path)).replace(os.sep, "/"))
         if paths:
-            util.run(f"npm pack {' '.join(paths)}", cwd=dest, quiet=True)
+            util.run(
+                f"npm pack {' '.join(paths)}", cwd=dest, quiet=True, tail=util.OUTPUT_TAIL_LINES
+            )
         else:
             util.log(
                 "The NPM package defines 'workspaces' that does not contain any public package; this may be a mistake."
@@ -129,7 +135,12 @@ def check_dist(dist_dir, install_options, repo):
 
         install_str = " ".join(f"./staging/{name}" for name in names)
 
-        util.run(f"npm install {install_options} {install_str}", cwd=td, quiet=True)
+        util.run(
+            f"npm install {install_options} {install_str}",
+            cwd=td,
+            quiet=True,
+            tail=util.OUTPUT_TAIL_LINES,
+        )
 
 
 def extract_package(path):
@@ -242,3 +253,132 @@ def _get_workspace_packages(data):
             paths.append(sub_package)
 
     return sorted(paths)
+
+
+def get_version_changes(version_spec, workspaces=False, include_root=True):
+    """Get the files changed by `npm version --git-tag-version false`.
+
+    With `workspaces`, all of the workspace packages are bumped in one pass,
+    like `npm version --workspaces`, along with the dependency ranges that
+    workspace packages use for each other.  Returns None if the bump needs
+    to be done by npm.
+    """
+    root_text = util.read_text_file(PACKAGE_JSON)
+    root = json.loads(root_text)
+    packages = {util.normalize_path(PACKAGE_JSON): (root_text, root)}
+    targets = list(packages)
+    if workspaces:
+        if "workspaces" not in root:
+            return None
+        for path in _get_workspace_packages(root):
+            package_json = util.normalize_path(path / "package.json")
+            text = util.read_text_file(package_json)
+            packages[package_json] = (text, json.loads(text))
+        targets = list(packages) if include_root else list(packages)[1:]
+
+    # Bump the package versions.
+    bumped = {}
+    changed = set()
+    for path in targets:
+        data = packages[path][1]
+        # Workspace packages without a version are not published.
+        if workspaces and "version" not in data:
+            continue
+        version = _get_new_version(data, version_spec)
+        if not version:
+            return None
+        bumped[data.get("name", "")] = (data.get("version", ""), version)
+        data["version"] = version
+        changed.add(path)
+
+    # Update the ranges of dependencies between workspace packages.
+    for path, (_, data) in packages.items():
+        if _update_dependency_ranges(data, bumped):
+            changed.add(path)
+
+    changes = {}
+    for path, (text, data) in packages.items():
+        if path in changed:
+            changes[path] = _dump_json_like(data, text)
+
+    for lock_file in [Path("package-lock.json"), Path("npm-shrinkwrap.json")]:
+        if not lock_file.exists():
+            continue
+        lock_text = util.read_text_file(lock_file)
+        lock_data = json.loads(lock_text)
+        if root.get("name", "") in bumped:
+            lock_data["version"] = root["version"]
+        for location, entry in lock_data.get("packages", {}).items():
+            package_json = util.normalize_path(Path(location) / "package.json")
+            if package_json in packages:
+                data = packages[package_json][1]
+                if "version" in data:
+                    entry["version"] = data["version"]
+                _update_dependency_ranges(entry, bumped)
+        changes[util.normalize_path(lock_file)] = _dump_json_like(lock_data, lock_text)
+    return changes
+
+
+def _get_new_version(data, version_spec):
+    """Get the version `npm version <version_spec>` would give a package."""
+    scripts = data.get("scripts", {})
+    if any(name in scripts for name in ["preversion", "version", "postversion"]):
+        return None
+
+    current = data.get("version", "")
+    if version_spec in ["major", "minor", "patch"]:
+        version = _increment_semver(current, version_spec)
+    else:
+        version = version_spec[1:] if version_spec.startswith("v") else version_spec
+    if not version or not SEMVER_PATTERN.fullmatch(version) or version == current:
+        return None
+    return version
+
+
+def _update_dependency_ranges(data, bumped):
+    """Point dependency ranges on the old version of bumped packages to the new one."""
+    changed = False
+    for section in ["dependencies", "devDependencies", "peerDependencies", "optionalDependencies"]:
+        dependencies = data.get(section, {})
+        for name, spec in dependencies.items():
+            if name not in bumped:
+                continue
+            old, new = bumped[name]
+            match = re.fullmatch(r"(workspace:)?(\^|~|>=|=)?v?" + re.escape(old), spec)
+            if match:
+                dependencies[name] = "".join(match.groups("")) + new
+                changed = True
+    return changed
+
+
+def _increment_semver(version, release_type):
+    """Increment a semver version the way `npm version <release_type>` does."""
+    match = SEMVER_PATTERN.fullmatch(version)
+    if not match:
+        return None
+    major, minor, patch = (int(part) for part in match.group(1, 2, 3))
+    prerelease = bool(match.group(4))
+    if release_type == "major":
+        if prerelease and minor == 0 and patch == 0:
+            return f"{major}.0.0"
+        return f"{major + 1}.0.0"
+    if release_type == "minor":
+        if prerelease and patch == 0:
+            return f"{major}.{minor}.0"
+        return f"{major}.{minor + 1}.0"
+    if prerelease:
+        return f"{major}.{minor}.{patch}"
+    return f"{major}.{minor}.{patch + 1}"
+
+
+def _dump_json_like(data, text):
+    """Serialize JSON data with the indentation and line endings of the original text."""
+    match = re.search(r"^([ \t]+)\S", text, re.M)
+    indent = match.group(1) if match else 2
+    newline = "\r\n" if "\r\n" in text else "\n"
+    output = json.dumps(data, indent=indent, ensure_ascii=False)
+    if newline != "\n":
+        output = output.replace("\n", newline)
+    if text.endswith(("\n", "\r\n")):
+        output += newline
+    return output
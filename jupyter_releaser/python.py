@@ -14,8 +14,6 @@ from subprocess import PIPE, CalledProcessError, Popen
 from tempfile import TemporaryDirectory
 from typing import cast
 
-import requests
-
 from jupyter_releaser import util
 
 PYPROJECT = util.PYPROJECT
@@ -33,7 +31,12 @@ def build_dist(dist_dir, clean=True):
         for pkg in glob(f"{dest}/*.gz") + glob(f"{dest}/*.whl"):
             os.remove(pkg)
 
-    util.run(f"pipx run --spec build pyproject-build --outdir {dest} .", quiet=True, show_cwd=True)
+    util.run(
+        f"pipx run --spec build pyproject-build --outdir {dest} .",
+        quiet=True,
+        show_cwd=True,
+        tail=util.OUTPUT_TAIL_LINES,
+    )
 
 
 def check_dist(
@@ -81,8 +84,7 @@ def check_dist(
         util.run(f"{bin_path}/python -m pip install -q -U pip")
         util.run(f"{bin_path}/pip install -q {dist_file}")
         try:
-            for cmd in test_commands:
-                util.run(f"{bin_path}/{cmd}")
+            util.run_many([f"{bin_path}/{cmd}" for cmd in test_commands])
         except CalledProcessError as e:
             if test_cmd == "":
                 util.log(
@@ -123,7 +125,8 @@ def fetch_pypi_api_token() -> "str":
     headers = {"Authorization": f"bearer {auth}", "Accept": "application/octet-stream"}
 
     sink = BytesIO()
-    with requests.get(f"{url}&audience=pypi", headers=headers, stream=True, timeout=60) as r:
+    session = util.get_session()
+    with session.get(f"{url}&audience=pypi", headers=headers, stream=True, timeout=60) as r:
         r.raise_for_status()
         for chunk in r.iter_content(chunk_size=8192):
             sink.write(chunk)
@@ -136,7 +139,7 @@ def fetch_pypi_api_token() -> "str":
 
     util.log("Fetching PyPI API token...")
     sink = BytesIO()
-    with requests.post(PYPI_GH_API_TOKEN_URL, json={"token": oidc_token}, timeout=10) as r:
+    with session.post(PYPI_GH_API_TOKEN_URL, json={"token": oidc_token}, timeout=10) as r:
         r.raise_for_status()
         for chunk in r.iter_content(chunk_size=8192):
             sink.write(chunk)
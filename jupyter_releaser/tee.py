@@ -22,12 +22,36 @@
 # THE SOFTWARE.
 import asyncio
 import atexit
+import contextlib
+import json
 import os
 import platform
+import shlex
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import weakref
 from asyncio import StreamReader
-from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
+from collections import deque
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Coroutine,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    TypeVar,
+    Union,
+)
 
 if TYPE_CHECKING:
     CompletedProcess = subprocess.CompletedProcess[Any]  # pylint: disable=E1136
@@ -39,9 +63,165 @@ try:
 except ImportError:
     from subprocess import list2cmdline as join  # type:ignore[assignment]
 
+if sys.platform != "win32":
+    import resource
+
 
 STREAM_LIMIT = 2**23  # 8MB instead of default 64kb, override it if you need
 
+# Commands that contain any of these characters or start with a shell builtin
+# are run through the shell, other commands are executed directly.
+SHELL_METACHARACTERS = frozenset("|&;<>()$`\\*?[]{}~#!\n")
+SHELL_BUILTINS = frozenset(
+    ". alias cd command eval exec exit export set source trap type ulimit umask unset wait".split()
+)
+
+# Set this environment variable to a file path to record a trace of all of
+# the commands that are run.
+TRACE_FILE_ENV = "RH_TRACE_FILE"
+
+# Set this environment variable to a number of seconds to use as the default
+# timeout of all commands.
+TIMEOUT_ENV = "RH_COMMAND_TIMEOUT"
+# How long to wait after sending SIGTERM to a timed out command before
+# sending SIGKILL.
+KILL_GRACE_PERIOD = 10.0
+
+# A single event loop shared by every synchronous call to `run`, so that we
+# do not pay for loop setup (and register another atexit handler) on each
+# command.
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+T = TypeVar("T")
+
+
+class CommandTimeoutError(subprocess.TimeoutExpired):
+    """A command did not complete within its timeout and was killed.
+
+    The output that was captured before the command was killed is available
+    as `output` and `stderr`, and in full as `stdout_capture` and
+    `stderr_capture`.  `returncode` is the (negative) signal that stopped the
+    command, if it was reaped.
+    """
+
+    returncode: Optional[int] = None
+
+
+class LogSink:
+    """A buffered writer for log output on `sys.stderr`.
+
+    Text is written out in batches, once `max_size` characters have been
+    buffered, `max_delay` seconds after the first buffered write when an
+    event loop is running, or when `flush` is called.
+    """
+
+    def __init__(self, max_size: int = 2**16, max_delay: float = 0.1) -> None:
+        """Initialize the sink."""
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._buffer: List[str] = []
+        self._size = 0
+        self._stream: Optional[IO[str]] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> None:
+        """Write text to the sink."""
+        with self._lock:
+            # Never let text meant for one stream end up in another, e.g.
+            # when sys.stderr is swapped out by a test runner.
+            if sys.stderr is not self._stream:
+                self._flush()
+                self._stream = sys.stderr
+            if not self._buffer:
+                self._schedule()
+            self._buffer.append(text)
+            self._size += len(text)
+            if self._size >= self.max_size:
+                self._flush()
+
+    def flush(self) -> None:
+        """Write out any buffered text."""
+        with self._lock:
+            self._flush()
+
+    def _schedule(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._timer = loop.call_later(self.max_delay, self.flush)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._buffer and self._stream is not None:
+            self._stream.write("".join(self._buffer))
+            self._stream.flush()
+        self._buffer.clear()
+        self._size = 0
+
+
+# The sink shared by the output of all commands and `util.log`.
+log_sink = LogSink()
+atexit.register(log_sink.flush)
+
+
+class OutputCapture:
+    """Captured output lines of a subprocess stream.
+
+    When a `tail` is given, only the last `tail` lines are kept in memory
+    and the full output is spilled to a temporary file once it grows past
+    that, to be read back lazily with `read` or by iterating.
+    """
+
+    def __init__(self, tail: Optional[int] = None) -> None:
+        """Initialize the capture."""
+        self.lines: Deque[str] = deque(maxlen=tail)
+        self.count = 0
+        self.nbytes = 0
+        self._spill: Optional[IO[str]] = None
+
+    def append(self, line: str) -> None:
+        """Add a line of output."""
+        if self._spill is None and len(self.lines) == self.lines.maxlen:
+            self._spill = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+            weakref.finalize(self, self._spill.close)
+            self._spill.writelines(f"{li}\n" for li in self.lines)
+        if self._spill is not None:
+            self._spill.write(f"{line}\n")
+        self.lines.append(line)
+        self.count += 1
+
+    def __bool__(self) -> bool:
+        return self.count > 0
+
+    def __iter__(self) -> Iterator[str]:
+        if self._spill is None:
+            yield from list(self.lines)
+            return
+        self._spill.flush()
+        self._spill.seek(0)
+        for line in self._spill:
+            yield line.rstrip("\n")
+        self._spill.seek(0, os.SEEK_END)
+
+    def text(self) -> str:
+        """Get the captured lines that are held in memory."""
+        return os.linesep.join(self.lines) + os.linesep
+
+    def read(self) -> str:
+        """Read the full output, including lines that were spilled to disk."""
+        return os.linesep.join(self) + os.linesep
+
+    def close(self) -> None:
+        """Remove the spill file, if any."""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
 
 async def _read_stream(stream: StreamReader, callback: Callable[..., Any]) -> None:
     while True:
@@ -52,11 +232,99 @@ async def _read_stream(stream: StreamReader, callback: Callable[..., Any]) -> No
             break
 
 
-async def _stream_subprocess(args: str, **kwargs: Any) -> CompletedProcess:
+def _get_argv(args: Union[str, List[str]]) -> Optional[List[str]]:
+    """Get the argv to execute a command directly, or None if it needs a shell."""
+    if not isinstance(args, str):
+        return list(args)
+    if any(char in SHELL_METACHARACTERS for char in args):
+        return None
+    try:
+        argv = shlex.split(args)
+    except ValueError:
+        return None
+    if not argv or "=" in argv[0] or argv[0] in SHELL_BUILTINS:
+        return None
+    return argv
+
+
+async def _create_subprocess(
+    args: Union[str, List[str]], stdin: Any, platform_settings: Dict[str, Any]
+) -> asyncio.subprocess.Process:
+    """Create the subprocess, skipping the shell when it is not needed."""
+    # Some users are reporting that default (undocumented) limit 64k is too
+    # low
+    options: Dict[str, Any] = {
+        "limit": STREAM_LIMIT,
+        "stdin": stdin,
+        "stdout": asyncio.subprocess.PIPE,
+        "stderr": asyncio.subprocess.PIPE,
+    }
+    argv = _get_argv(args)
+    if argv is not None:
+        exec_settings = {k: v for k, v in platform_settings.items() if k != "executable"}
+        try:
+            return await asyncio.create_subprocess_exec(
+                argv[0], *argv[1:], **options, **exec_settings
+            )
+        except (FileNotFoundError, PermissionError):
+            # Let the shell report the error as it would have.
+            if not isinstance(args, str):
+                args = join(args)
+
+    assert isinstance(args, str)
+    return await asyncio.create_subprocess_shell(args, **options, **platform_settings)
+
+
+def _get_timeout(kwargs: Dict[str, Any]) -> Optional[float]:
+    """Get the timeout for a command, falling back on the global timeout."""
+    timeout = kwargs.get("timeout")
+    if timeout is None and os.environ.get(TIMEOUT_ENV):
+        timeout = float(os.environ[TIMEOUT_ENV])
+    return timeout or None
+
+
+def _signal_process(process: asyncio.subprocess.Process, sig: int, group: bool) -> None:
+    """Send a signal to a process, or to its whole process group."""
+    try:
+        if sys.platform == "win32":  # pragma: no cover
+            process.kill()
+        elif group:
+            os.killpg(process.pid, sig)
+        else:
+            process.send_signal(sig)
+    except ProcessLookupError:
+        pass
+
+
+async def _terminate(process: asyncio.subprocess.Process, grace_period: float, group: bool) -> None:
+    """Send SIGTERM, then SIGKILL if the process is still running after the grace period."""
+    _signal_process(process, signal.SIGTERM, group)
+    try:
+        await asyncio.wait_for(process.wait(), grace_period)
+    except asyncio.TimeoutError:
+        _signal_process(process, getattr(signal, "SIGKILL", signal.SIGTERM), group)
+        await process.wait()
+    # The process is gone, but its children may still be running.
+    if group:
+        _signal_process(process, getattr(signal, "SIGKILL", signal.SIGTERM), group)
+
+
+async def _stream_subprocess(args: Union[str, List[str]], **kwargs: Any) -> CompletedProcess:
     platform_settings: Dict[str, Any] = {}
     if platform.system() == "Windows":
         platform_settings["env"] = os.environ
 
+    # Run commands with a timeout in their own process group, so that we can
+    # kill the command along with any processes it started.  The group stays
+    # in our session, so that the command can still use the terminal.
+    timeout = _get_timeout(kwargs)
+    grace_period = kwargs.get("grace_period", KILL_GRACE_PERIOD)
+    group = timeout is not None and sys.platform != "win32"
+    if group and sys.version_info >= (3, 11):
+        platform_settings["process_group"] = 0
+    elif group:
+        platform_settings["preexec_fn"] = os.setpgrp
+
     # this part keeps behavior backwards compatible with subprocess.run
     tee = kwargs.get("tee", True)
     stdout = kwargs.get("stdout", sys.stdout)
@@ -70,7 +338,7 @@ async def _stream_subprocess(args: str, **kwargs: Any) -> CompletedProcess:
     # commands.
     # * SHELL is not always defined
     # * /bin/bash does not exit on alpine, /bin/sh seems bit more portable
-    if "executable" not in kwargs and isinstance(args, str) and " " in args:  # type:ignore[redundant-expr]
+    if "executable" not in kwargs and isinstance(args, str) and " " in args:
         platform_settings["executable"] = os.environ.get("SHELL", "/bin/sh")
 
     # pass kwargs we know to be supported
@@ -78,26 +346,28 @@ async def _stream_subprocess(args: str, **kwargs: Any) -> CompletedProcess:
         if arg in kwargs:
             platform_settings[arg] = kwargs[arg]
 
-    # Some users are reporting that default (undocumented) limit 64k is too
-    # low
-    process = await asyncio.create_subprocess_shell(
-        args,
-        limit=STREAM_LIMIT,
-        stdin=kwargs.get("stdin", False),
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        **platform_settings,
-    )
-    out: List[str] = []
-    err: List[str] = []
+    process = await _create_subprocess(args, kwargs.get("stdin", False), platform_settings)
+    # Only keep the last lines in memory if asked to.
+    tail = kwargs.get("tail")
+    out = OutputCapture(tail)
+    err = OutputCapture(tail)
 
-    def tee_func(line: bytes, sink: List[str], pipe: Optional[Any]) -> None:  # noqa: ARG001
+    # Optionally hold the output until the process exits, so that the
+    # output of concurrent commands does not get interleaved.
+    prefix = kwargs.get("prefix", "")
+    grouped: Optional[List[str]] = [] if kwargs.get("group", False) else None
+
+    def tee_func(line: bytes, sink: OutputCapture, pipe: Optional[Any]) -> None:  # noqa: ARG001
         line_str = line.decode("utf-8").rstrip()
         sink.append(line_str)
+        sink.nbytes += len(line)
         if not kwargs.get("quiet", False):
             # This is modified from the default implementation since
             # we want all output to be interleved on the same stream
-            print(line_str, file=sys.stderr)
+            if grouped is not None:
+                grouped.append(prefix + line_str)
+            else:
+                log_sink.write(f"{prefix}{line_str}\n")
 
     loop = asyncio.get_running_loop()
     tasks = []
@@ -110,7 +380,33 @@ async def _stream_subprocess(args: str, **kwargs: Any) -> CompletedProcess:
             loop.create_task(_read_stream(process.stderr, lambda li: tee_func(li, err, stderr)))
         )
 
-    await asyncio.wait(set(tasks))
+    deadline = None if timeout is None else loop.time() + timeout
+    timed_out = False
+    try:
+        _, pending = await asyncio.wait(set(tasks), timeout=timeout)
+        if pending:
+            timed_out = True
+        else:
+            remaining = None if deadline is None else max(deadline - loop.time(), 0)
+            await asyncio.wait_for(process.wait(), remaining)
+    except asyncio.TimeoutError:
+        timed_out = True
+    except asyncio.CancelledError:
+        await _terminate(process, grace_period, group)
+        for task in tasks:
+            task.cancel()
+        raise
+
+    if timed_out:
+        await _terminate(process, grace_period, group)
+        # Collect the output that is still buffered in the pipes.
+        _, pending = await asyncio.wait(set(tasks), timeout=1)
+        for task in pending:
+            task.cancel()
+
+    if grouped:
+        log_sink.write(os.linesep.join(grouped) + "\n")
+    log_sink.flush()
 
     # We need to be sure we keep the stdout/stderr output identical with
     # the ones procued by subprocess.run(), at least when in text mode.
@@ -118,45 +414,252 @@ async def _stream_subprocess(args: str, **kwargs: Any) -> CompletedProcess:
     stdout = None if check else ""
     stderr = None if check else ""
     if out:
-        stdout = os.linesep.join(out) + os.linesep
+        stdout = out.text()
     if err:
-        stderr = os.linesep.join(err) + os.linesep
+        stderr = err.text()
+
+    if timed_out:
+        assert timeout is not None
+        cmd = args if isinstance(args, str) else join(args)
+        error = CommandTimeoutError(cmd, timeout, output=stdout, stderr=stderr)
+        error.returncode = process.returncode
+        error.stdout_capture = out  # type:ignore[attr-defined]
+        error.stderr_capture = err  # type:ignore[attr-defined]
+        raise error
 
-    return CompletedProcess(
+    result = CompletedProcess(
         args=args,
         returncode=await process.wait(),
         stdout=stdout,
         stderr=stderr,
     )
+    # Give access to the full output when only the tail was kept.
+    result.stdout_capture = out  # type:ignore[attr-defined]
+    result.stderr_capture = err  # type:ignore[attr-defined]
+    return result
 
 
-def run(args: Union[str, List[str]], **kwargs: Any) -> CompletedProcess:
-    """Drop-in replacement for subprocess.run that behaves like tee.
-    Extra arguments added by our version:
-    echo: False - Prints command before executing it.
-    quiet: False - Avoid printing output
-    show_cwd: False - Prints the current working directory.
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """Get the shared event loop, creating it if needed."""
+    global _loop  # noqa: PLW0603
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop
+
+
+def close() -> None:
+    """Close the shared event loop used by `run`.
+
+    This is called automatically at exit, a new loop will be created
+    if `run` is called again afterwards.
     """
-    if isinstance(args, str):  # noqa: SIM108
-        cmd = args
-    else:
-        # run was called with a list instead of a single item but asyncio
-        # create_subprocess_shell requires command as a single string, so
-        # we need to convert it to string
-        cmd = join(args)
+    global _loop  # noqa: PLW0603
+    with _loop_lock:
+        if _loop is not None and not _loop.is_closed():
+            _loop.run_until_complete(_loop.shutdown_asyncgens())
+            _loop.close()
+        _loop = None
+
+
+atexit.register(close)
+
+
+def _child_cpu_time() -> float:
+    """Get the CPU time used by all of the waited for child processes."""
+    if sys.platform == "win32":  # pragma: no cover
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
 
-    check = kwargs.get("check", False)
+
+# The trace lanes (thread ids) of the commands that are running.
+_trace_lanes: Set[int] = set()
+
+
+def write_trace(
+    cmd: str,
+    cwd: str,
+    start: float,
+    wall_time: float,
+    returncode: Optional[int],
+    output_bytes: int,
+    cpu_time: float,
+    lane: int = 0,
+) -> None:
+    """Record a command that was run, if the trace file env variable is set.
+
+    The record is appended as a JSON line to the trace file, and as a
+    complete event to a Chrome trace-event file next to it with a
+    ".trace.json" suffix, which can be loaded in chrome://tracing or
+    https://ui.perfetto.dev.  Both files can be shared by several processes.
+    """
+    path = os.environ.get(TRACE_FILE_ENV)
+    if not path:
+        return
+
+    record = {
+        "command": cmd,
+        "cwd": cwd,
+        "start": start,
+        "wall_time": wall_time,
+        "returncode": returncode,
+        "output_bytes": output_bytes,
+        "cpu_time": cpu_time,
+        "pid": os.getpid(),
+    }
+    with open(path, "a", encoding="utf-8") as fid:
+        fid.write(json.dumps(record) + "\n")
+
+    event = {
+        "name": cmd,
+        "cat": "subprocess",
+        "ph": "X",
+        "ts": round(start * 1e6),
+        "dur": round(wall_time * 1e6),
+        "pid": os.getpid(),
+        "tid": lane,
+        "args": {k: record[k] for k in ["cwd", "returncode", "output_bytes", "cpu_time"]},
+    }
+    # The closing bracket of the JSON array format is optional, which lets
+    # us append events as they come.
+    chrome_path = os.path.splitext(path)[0] + ".trace.json"
+    with open(chrome_path, "a", encoding="utf-8") as fid:
+        if not fid.tell():
+            fid.write("[\n")
+        fid.write(json.dumps(event) + ",\n")
+
+
+async def _traced_subprocess(args: Union[str, List[str]], **kwargs: Any) -> CompletedProcess:
+    """Run `_stream_subprocess` and record a trace of it.
+
+    Commands that time out are recorded too, with the output captured before
+    they were killed.
+    """
+    lane = min(set(range(len(_trace_lanes) + 1)) - _trace_lanes)
+    _trace_lanes.add(lane)
+    start = time.time()
+    cpu_start = _child_cpu_time()
+
+    def trace(result: Union[CompletedProcess, CommandTimeoutError]) -> None:
+        write_trace(
+            args if isinstance(args, str) else join(args),
+            os.path.abspath(kwargs.get("cwd") or os.getcwd()),
+            start,
+            time.time() - start,
+            result.returncode,
+            result.stdout_capture.nbytes + result.stderr_capture.nbytes,  # type:ignore[union-attr]
+            # This includes other children that exited meanwhile when running
+            # commands concurrently.
+            _child_cpu_time() - cpu_start,
+            lane,
+        )
 
     try:
-        loop = asyncio.get_event_loop()
-    except Exception:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-    result = loop.run_until_complete(_stream_subprocess(cmd, **kwargs))
-    atexit.register(loop.close)
+        result = await _stream_subprocess(args, **kwargs)
+    except CommandTimeoutError as e:
+        trace(e)
+        raise
+    finally:
+        _trace_lanes.discard(lane)
+    trace(result)
+    return result
+
+
+async def run_async(args: Union[str, List[str]], **kwargs: Any) -> CompletedProcess:
+    """Awaitable version of `run`, for use from a running event loop."""
+    # Lists are executed directly, but use a string for error messages.
+    cmd = args if isinstance(args, str) else join(args)
+
+    check = kwargs.get("check", False)
+
+    if os.environ.get(TRACE_FILE_ENV):
+        result = await _traced_subprocess(args, **kwargs)
+    else:
+        result = await _stream_subprocess(args, **kwargs)
 
     if check and result.returncode != 0:
         raise subprocess.CalledProcessError(
             result.returncode, cmd, output=result.stdout, stderr=result.stderr
         )
     return result
+
+
+async def run_many_async(
+    cmds: Sequence[Union[str, List[str]]], max_concurrency: Optional[int] = None, **kwargs: Any
+) -> List[CompletedProcess]:
+    """Run independent commands concurrently.
+
+    The output of each command is prefixed with its index and printed as a
+    single group once the command exits.  The results are returned in the
+    same order as `cmds`, and `check` is not honored, look at the return
+    codes instead.  If a command times out, the others are stopped and a
+    `CommandTimeoutError` is raised.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency or os.cpu_count() or 1)
+    kwargs["check"] = False
+    kwargs.setdefault("group", True)
+
+    async def run_one(index: int, cmd: Union[str, List[str]]) -> CompletedProcess:
+        async with semaphore:
+            return await run_async(cmd, prefix=f"[{index}] ", **kwargs)
+
+    tasks = [asyncio.ensure_future(run_one(i, cmd)) for i, cmd in enumerate(cmds, 1)]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        # Fail fast, e.g. on a timeout, and stop the other commands.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def run_many(
+    cmds: Sequence[Union[str, List[str]]], max_concurrency: Optional[int] = None, **kwargs: Any
+) -> List[CompletedProcess]:
+    """Run independent commands concurrently on the shared event loop.
+
+    See `run_many_async` for details.
+    """
+    return _run_until_complete(run_many_async(cmds, max_concurrency, **kwargs))
+
+
+def run(args: Union[str, List[str]], **kwargs: Any) -> CompletedProcess:
+    """Drop-in replacement for subprocess.run that behaves like tee.
+    Extra arguments added by our version:
+    echo: False - Prints command before executing it.
+    quiet: False - Avoid printing output
+    show_cwd: False - Prints the current working directory.
+    tail: None - Only keep this many of the last output lines in memory,
+        the full output is available from `stdout_capture` and
+        `stderr_capture` on the result.
+    timeout: None - Kill the command and raise a `CommandTimeoutError` if it
+        does not complete in this many seconds, defaults to the value of
+        the RH_COMMAND_TIMEOUT environment variable.
+    grace_period: 10 - How long to wait after sending SIGTERM to a timed out
+        command before sending SIGKILL.
+
+    All calls share a single event loop, use `run_async` instead when
+    calling from a coroutine.
+    """
+    return _run_until_complete(run_async(args, **kwargs))
+
+
+def _run_until_complete(coro: Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine on the shared event loop.
+
+    If we are interrupted, e.g. by Ctrl-C, which does not reach commands
+    running in their own process group, the commands are stopped before
+    the exception is raised.
+    """
+    with _loop_lock:
+        loop = _get_loop()
+        task = loop.create_task(coro)
+        try:
+            return loop.run_until_complete(task)
+        except BaseException:
+            if not task.done():
+                task.cancel()
+                with contextlib.suppress(BaseException):
+                    loop.run_until_complete(task)
+            raise
@@ -1,9 +1,13 @@
 """Jupyter Releaser Utils."""
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
+import ast
 import atexit
+import configparser
 import hashlib
 import json
+import mimetypes
+import mmap
 import os
 import os.path as osp
 import re
@@ -12,25 +16,34 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import warnings
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from io import BytesIO
 from pathlib import Path
-from subprocess import PIPE, CalledProcessError, check_output
-from urllib.parse import urlparse
+from subprocess import PIPE, CalledProcessError, TimeoutExpired, check_output
+from urllib.error import HTTPError
+from urllib.parse import unquote, urlparse
 
 import requests
 import toml
+from fastcore.net import HTTP404NotFoundError  # type:ignore[import-untyped]
+from fastcore.xtras import dict2obj, obj2dict  # type:ignore[import-untyped]
 from ghapi import core
 from importlib_resources import files  # type:ignore[import-not-found]
 from jsonschema import Draft4Validator as Validator
-from packaging.version import Version
+from packaging.version import InvalidVersion, Version
 from packaging.version import parse as parse_version
 from pkginfo import Wheel
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
+from jupyter_releaser.tee import CommandTimeoutError, _get_timeout, log_sink, write_trace
 from jupyter_releaser.tee import run as tee
+from jupyter_releaser.tee import run_many as tee_many
 
 PYPROJECT = Path("pyproject.toml")
 SETUP_PY = Path("setup.py")
@@ -42,7 +55,19 @@ JUPYTER_RELEASER_CONFIG = Path(".jupyter-releaser.toml")
 METADATA_JSON = Path("metadata.json")
 
 BUF_SIZE = 65536
+MAX_BUF_SIZE = 2**22
+MMAP_THRESHOLD = 2**26
+DIGEST_ALGORITHMS = ("sha256",)
+MAX_TRANSFER_WORKERS = 8
+MAX_BYTES_IN_FLIGHT = 2**30
+DOWNLOAD_RETRIES = 3
+HTTP_RETRIES = 3
+UPLOAD_WORKERS_ENV = "RH_UPLOAD_WORKERS"
+# The number of output lines to keep in memory for verbose commands whose
+# output we only need if they fail.
+OUTPUT_TAIL_LINES = 100
 TBUMP_CMD = "pipx run tbump --non-interactive --only-patch"
+HATCH_VERSION_PATTERN = r"(?i)^(__version__|VERSION) *= *([\'\"])v?(?P<version>.+?)\2"
 
 CHECKOUT_NAME = ".jupyter_releaser_checkout"
 RELEASE_HTML_PATTERN = (
@@ -51,6 +76,17 @@ RELEASE_HTML_PATTERN = (
 RELEASE_API_PATTERN = (
     "https://api.github.com/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/releases/tags/(?P<tag>.*)"
 )
+RELEASE_ID_PATTERN = "/repos/(?P<owner>[^/]+)/(?P<repo>[^/]+)/releases/(?P<id>[0-9]+)$"
+RELEASES_PER_PAGE = 100
+CACHE_DIR_ENV = "RH_CACHE_DIR"
+GITHUB_CACHE_MAX_SIZE = 2**27
+GITHUB_MAX_CONCURRENCY = 8
+GITHUB_RATE_LIMIT_RETRIES = 3
+# The longest we will wait for the GitHub rate limit to reset, in seconds.
+GITHUB_MAX_RATE_LIMIT_WAIT = 900
+# How long to wait after hitting a secondary rate limit without a
+# Retry-After header, as recommended by GitHub.
+GITHUB_SECONDARY_RATE_LIMIT_WAIT = 60
 
 SCHEMA = files("jupyter_releaser").joinpath("schema.json").read_text()
 SCHEMA = json.loads(SCHEMA)
@@ -60,6 +96,41 @@ GIT_FETCH_CMD = "git fetch origin --filter=blob:none --quiet"
 GH_ID_TOKEN_URL_VAR = "ACTIONS_ID_TOKEN_REQUEST_URL"  # noqa: S105
 GH_ID_TOKEN_TOKEN_VAR = "ACTIONS_ID_TOKEN_REQUEST_TOKEN"  # noqa: S105
 
+# Git commands (after the global options) that do not change HEAD, the refs
+# or the config, and so do not invalidate the git query cache.
+GIT_READ_ONLY_COMMANDS = {"branch", "remote", "stash list", "tag"}
+GIT_READ_ONLY_PREFIXES = (
+    "branch --show-current",
+    "cat-file",
+    "config --get",
+    "describe",
+    "diff",
+    "log",
+    "ls-files",
+    "ls-remote",
+    "merge-base",
+    "remote -v",
+    "remote get-url",
+    "remote show",
+    "rev-list",
+    "rev-parse",
+    "show",
+    "status",
+    "symbolic-ref -q",
+    "tag --merged",
+    "tag --sort",
+)
+
+# Memoized results of git queries, keyed on the git directory and the
+# command, see `git_query`.
+_git_cache: dict[tuple[str, str], tuple[tuple[object, ...], str]] = {}
+git_cache_stats = {"hits": 0, "misses": 0}
+_default_branches: dict[str, str | None] = {}
+_version_cache: dict[tuple[str, ...], tuple[str, dict[str, str]]] = {}
+_digest_cache: dict[tuple[object, ...], dict[str, str]] = {}
+github_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+github_rate_limit_stats = {"requests": 0, "retries": 0, "throttled": 0}
+
 
 def run(cmd, **kwargs):
     """Run a command as a subprocess and get the output as a string"""
@@ -68,6 +139,9 @@ def run(cmd, **kwargs):
     quiet = kwargs.get("quiet", False)
     echo = kwargs.pop("echo", False)
 
+    if _git_cache and _changes_git_state(cmd):
+        invalidate_git_cache()
+
     if echo:
         prefix = "COMMAND"
         if show_cwd:
@@ -78,7 +152,20 @@ def run(cmd, **kwargs):
     if sys.platform.startswith("win"):
         # Async subprocesses do not work well on Windows, use standard
         # subprocess methods
-        return _run_win(cmd, **kwargs)
+        start = time.time()
+        returncode, output = 0, None
+        try:
+            output = _run_win(cmd, **kwargs)
+        except CalledProcessError as e:
+            returncode = e.returncode
+            raise e
+        except CommandTimeoutError:
+            returncode = None
+            raise
+        finally:
+            cwd = os.path.abspath(kwargs.get("cwd") or os.getcwd())
+            write_trace(cmd, cwd, start, time.time() - start, returncode, len(output or ""), 0.0)
+        return output
 
     kwargs.setdefault("check", True)
 
@@ -94,9 +181,52 @@ def run(cmd, **kwargs):
         raise e
 
 
+def run_many(cmds, max_concurrency=None, **kwargs):
+    """Run independent commands concurrently and get their results in order.
+
+    The output of each command is prefixed with its index and kept grouped.
+    Returns a list of `CompletedProcess` objects, one per command.  If
+    `check` is true (the default), a `CalledProcessError` is raised for the
+    first failed command once all of the commands have completed.
+    """
+    check = kwargs.pop("check", True)
+    echo = kwargs.pop("echo", True)
+    cmds = list(cmds)
+
+    if echo:
+        log(f"Running {len(cmds)} commands (max concurrency {max_concurrency or os.cpu_count()}):")
+        for index, cmd in enumerate(cmds, 1):
+            log(f"  [{index}] {cmd}")
+
+    if sys.platform.startswith("win"):
+        # Async subprocesses do not work well on Windows, run the commands
+        # one at a time instead
+        results = []
+        for cmd in cmds:
+            try:
+                output = _run_win(cmd, **kwargs)
+                results.append(subprocess.CompletedProcess(cmd, 0, output, ""))
+            except CalledProcessError as e:
+                results.append(subprocess.CompletedProcess(cmd, e.returncode, e.output, e.stderr))
+    else:
+        results = tee_many(cmds, max_concurrency, **kwargs)
+
+    if check:
+        for result in results:
+            if result.returncode != 0:
+                raise CalledProcessError(
+                    result.returncode, result.args, output=result.stdout, stderr=result.stderr
+                )
+    return results
+
+
 def _run_win(cmd, **kwargs):
     """Run a command as a subprocess and get the output as a string"""
     quiet = kwargs.pop("quiet", False)
+    tail = kwargs.pop("tail", None)
+    # The command is killed right away on timeout, there is no grace period.
+    kwargs.pop("grace_period", None)
+    kwargs["timeout"] = _get_timeout(kwargs)
 
     # Always capture stderr so we can decode/log it on error
     kwargs.setdefault("stderr", PIPE)
@@ -115,6 +245,8 @@ def _run_win(cmd, **kwargs):
     try:
         output = check_output(parts, **kwargs).decode("utf-8").strip()  # noqa: S603
         log(output)
+        if tail:
+            output = "\n".join(output.splitlines()[-tail:])
         return output
     except CalledProcessError as e:
         if e.output is not None:
@@ -126,31 +258,166 @@ def _run_win(cmd, **kwargs):
             log("stdout:\n", e.output.strip(), "\n\n")
         if check:
             raise e
+    except TimeoutExpired as e:
+        output = e.output.decode("utf-8") if e.output else e.output
+        raise CommandTimeoutError(cmd, e.timeout, output=output) from None
 
 
 def log(*outputs, **kwargs):
     """Log an output to stderr"""
-    kwargs.setdefault("file", sys.stderr)
-    print(*outputs, **kwargs)
+    if "file" in kwargs:
+        print(*outputs, **kwargs)
+        return
+    sep = kwargs.get("sep", " ")
+    end = kwargs.get("end", "\n")
+    log_sink.write(sep.join(str(output) for output in outputs) + end)
+    log_sink.flush()
+
+
+def _changes_git_state(cmd):
+    """Whether a command may change the HEAD, refs or config of a git repo."""
+    parts = cmd.split() if isinstance(cmd, str) else list(cmd)
+    if not parts or osp.basename(parts[0]) not in ["git", "git.exe"]:
+        return False
+    # Skip the global options.
+    parts = parts[1:]
+    while parts and parts[0].startswith("-"):
+        option = parts.pop(0)
+        if option in ["-C", "-c"] and parts:
+            parts.pop(0)
+    args = " ".join(parts)
+    return args not in GIT_READ_ONLY_COMMANDS and not args.startswith(GIT_READ_ONLY_PREFIXES)
+
+
+def _find_git_dir():
+    """Find the git directory of the current working directory, if any."""
+    cwd = Path(os.getcwd()).resolve()
+    for path in [cwd, *cwd.parents]:
+        dot_git = path / ".git"
+        if dot_git.is_dir():
+            return dot_git
+        if dot_git.is_file():
+            # Worktrees and submodules point to their git directory.
+            text = dot_git.read_text(encoding="utf-8").strip()
+            if text.startswith("gitdir:"):
+                return (path / text[len("gitdir:") :].strip()).resolve()
+    return None
+
+
+def _git_common_dir(git_dir):
+    """Get the directory holding the refs and config shared by all worktrees."""
+    if (git_dir / "commondir").exists():
+        return (git_dir / (git_dir / "commondir").read_text(encoding="utf-8").strip()).resolve()
+    return git_dir
+
+
+def _git_state(git_dir):
+    """Get a token that changes when the HEAD, refs or config of a git repo change."""
+    common_dir = _git_common_dir(git_dir)
+    paths = [git_dir / "HEAD", common_dir / "config", common_dir / "packed-refs"]
+    paths += [common_dir / "refs" / name for name in ["", "heads", "remotes", "tags"]]
+    head = (git_dir / "HEAD").read_text(encoding="utf-8").strip()
+    if head.startswith("ref:"):
+        paths.append(common_dir / head[len("ref:") :].strip())
+
+    state: list[tuple[int, int, int] | None] = []
+    for path in paths:
+        try:
+            stat = path.stat()
+            state.append((stat.st_mtime_ns, stat.st_size, stat.st_ino))
+        except OSError:
+            state.append(None)
+    return (head, *state)
+
+
+def invalidate_git_cache():
+    """Clear the cached results of git queries."""
+    _git_cache.clear()
+
+
+def git_query(cmd):
+    """Run a read-only git command, memoized on the state of the repository.
+
+    Cached results are reused until the HEAD, refs or config of the
+    repository change on disk, or until `run` is used for a git command
+    that may change them.
+    """
+    git_dir = _find_git_dir()
+    if git_dir is None:
+        return run(cmd)
+
+    key = (str(git_dir), cmd)
+    state = _git_state(git_dir)
+    if key in _git_cache and _git_cache[key][0] == state:
+        git_cache_stats["hits"] += 1
+        return _git_cache[key][1]
+
+    git_cache_stats["misses"] += 1
+    value = run(cmd)
+    _git_cache[key] = (state, value)
+    return value
 
 
 def get_branch():
     """Get the appropriate git branch"""
-    return run("git branch --show-current")
+    return git_query("git branch --show-current")
+
+
+def get_head_sha():
+    """Get the sha of the current git HEAD"""
+    return git_query("git rev-parse HEAD")
+
+
+def _get_remote_head():
+    """Get the default branch recorded locally in `refs/remotes/origin/HEAD`"""
+    prefix = "refs/remotes/origin/"
+    git_dir = _find_git_dir()
+    if git_dir is None:
+        return None
+
+    common_dir = _git_common_dir(git_dir)
+    head_file = common_dir / "refs" / "remotes" / "origin" / "HEAD"
+    if (common_dir / "reftable").is_dir():
+        # Refs are not stored as plain files, ask git instead.
+        try:
+            ref = git_query(f"git symbolic-ref -q {prefix}HEAD")
+        except CalledProcessError:
+            return None
+    elif head_file.exists():
+        ref = head_file.read_text(encoding="utf-8").strip()
+        ref = ref[len("ref:") :].strip() if ref.startswith("ref:") else ""
+    else:
+        return None
+
+    if ref.startswith(prefix):
+        return ref[len(prefix) :]
+    return None
 
 
 def get_default_branch():
     """Get the default remote branch"""
-    info = run("git remote show origin")
-    for line in info.splitlines():
-        if line.strip().startswith("HEAD branch:"):
-            return line.strip().split()[-1]
-    return None
+    # Prefer the remote HEAD recorded by clone, fetch or `git remote set-head`.
+    branch = _get_remote_head()
+    if branch:
+        return branch
+
+    # Otherwise ask the remote once per process.
+    url = git_query("git remote get-url origin")
+    if url not in _default_branches:
+        # Only cache the answer once the remote could be reached.
+        info = run("git remote show origin")
+        branch = None
+        for line in info.splitlines():
+            if line.strip().startswith("HEAD branch:"):
+                branch = line.strip().split()[-1]
+                break
+        _default_branches[url] = branch
+    return _default_branches[url]
 
 
 def get_repo():
     """Get the remote repo owner and name"""
-    url = run("git remote get-url origin")
+    url = git_query("git remote get-url origin")
     url = normalize_path(url)
     parts = url.split("/")[-2:]
     if ":" in parts[0]:
@@ -159,8 +426,59 @@ def get_repo():
     return "/".join(parts)
 
 
+def _get_version_cache_key():
+    """Get a key that changes when any of the files defining the version change."""
+    paths = [PYPROJECT, SETUP_PY, SETUP_CFG, PACKAGE_JSON]
+    if PYPROJECT.exists():
+        data = toml.loads(PYPROJECT.read_text(encoding="utf-8"))
+        version_config = data.get("tool", {}).get("hatch", {}).get("version", {})
+        if version_config.get("path"):
+            paths.append(Path(version_config["path"]))
+
+    key = [os.getcwd()]
+    contents = b""
+    for path in paths:
+        if path.exists():
+            text = path.read_bytes()
+            contents += text
+        key.append(_get_file_digest(path))
+
+    # Versions derived from git tags change with the refs.
+    git_dir = _find_git_dir()
+    if git_dir is not None and (b'"vcs"' in contents or b"setuptools_scm" in contents):
+        key.append(repr(_git_state(git_dir)))
+    return tuple(key)
+
+
+def _get_file_digest(path):
+    """Get the sha256 of a file, or an empty string if it cannot be read."""
+    try:
+        return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+    except OSError:
+        return ""
+
+
+def invalidate_version_cache():
+    """Clear the cached package versions."""
+    _version_cache.clear()
+
+
 def get_version():
     """Get the current package version"""
+    key = _get_version_cache_key()
+    if key in _version_cache:
+        version, read_files = _version_cache[key]
+        # Also check the files that the static resolver read.
+        if all(_get_file_digest(path) == digest for path, digest in read_files.items()):
+            return version
+
+    paths: list[Path] = []
+    version = _get_version(paths)
+    _version_cache[key] = (version, {str(path): _get_file_digest(path) for path in paths})
+    return version
+
+
+def _get_version(read_files=None):
     # Prefer to get a static version from pyproject.toml.
     if PYPROJECT.exists():
         text = PYPROJECT.read_text(encoding="utf-8")
@@ -174,19 +492,38 @@ def get_version():
         # the dynamic version.
         if data.get("build-system", {}).get("build-backend") == "hatchling.build":
             cmd = _get_hatch_version_cmd()
-            return run(cmd).split("\n")[-1]
+            return run(cmd, tail=1)
+
+    # Read setuptools versions statically when possible.
+    if SETUP_PY.exists() or SETUP_CFG.exists():
+        version = _get_static_version(read_files)
+        if version:
+            return version
 
     if SETUP_PY.exists():
         warnings.warn("Using deprecated setup.py invocation", stacklevel=2)
         try:
-            return run("python setup.py --version").split("\n")[-1]
+            return run("python setup.py --version", tail=1)
         except CalledProcessError as e:
             log(e)
 
+    # Get the version from the metadata prepared by the build backend, which
+    # avoids compiling extension modules.
+    if PYPROJECT.exists():
+        try:
+            version = _get_metadata_version()
+            if version:
+                return version
+        except Exception as e:
+            log(f"Could not prepare the wheel metadata: {e}")
+
     # Build the wheel and extract the version.
     if PYPROJECT.exists():
         with tempfile.TemporaryDirectory() as tempdir:
-            run(f"pipx run --spec build pyproject-build --wheel --outdir {tempdir}")
+            run(
+                f"pipx run --spec build pyproject-build --wheel --outdir {tempdir}",
+                tail=OUTPUT_TAIL_LINES,
+            )
             wheel_path = glob(f"{tempdir}/*.whl")[0]
             wheel = Wheel(wheel_path)
             return wheel.version
@@ -199,6 +536,199 @@ def get_version():
     raise ValueError(msg)
 
 
+def _get_static_version(read_files=None):
+    """Get the version of a setuptools project without running any of its code.
+
+    Handles literal `version` arguments to `setup()`, setup.cfg and
+    `tool.setuptools.dynamic` `attr:` and `file:` directives, and literal
+    `__version__` assignments.  Returns None if the version is only known
+    when the project is built, or a file it needs cannot be read.  The
+    other files that were read are appended to `read_files`.
+    """
+    read_files = [] if read_files is None else read_files
+    if SETUP_PY.exists():
+        try:
+            tree = ast.parse(SETUP_PY.read_text(encoding="utf-8"))
+        except (OSError, SyntaxError, ValueError):
+            return None
+        constants = _get_string_constants(tree)
+        setup_calls = [
+            node
+            for node in ast.walk(tree)
+            if isinstance(node, ast.Call)
+            and getattr(node.func, "id", getattr(node.func, "attr", None)) == "setup"
+        ]
+        if len(setup_calls) != 1:
+            return None
+        kwargs = {kw.arg: kw.value for kw in setup_calls[0].keywords}
+        if "version" in kwargs:
+            value = kwargs["version"]
+            if isinstance(value, ast.Name):
+                return _validate_static_version(constants.get(value.id))
+            if isinstance(value, ast.Constant) and isinstance(value.value, str):
+                return _validate_static_version(value.value)
+            return None
+        # The version may be hidden in `**kwargs`.
+        if None in kwargs:
+            return None
+
+    spec = None
+    if SETUP_CFG.exists():
+        config = configparser.ConfigParser(interpolation=None)
+        config.read(SETUP_CFG, encoding="utf-8")
+        spec = config.get("metadata", "version", fallback=None)
+        if spec and spec.startswith("attr:"):
+            version = _get_attr_version(spec[len("attr:") :].strip(), read_files)
+            return _validate_static_version(version)
+        if spec and spec.startswith("file:"):
+            paths = spec[len("file:") :].split(",")
+            return _validate_static_version(_read_version_files(paths, read_files))
+
+    if not spec and PYPROJECT.exists():
+        data = toml.loads(PYPROJECT.read_text(encoding="utf-8"))
+        dynamic = data.get("tool", {}).get("setuptools", {}).get("dynamic", {})
+        version_config = dynamic.get("version", {})
+        if "attr" in version_config:
+            version = _get_attr_version(version_config["attr"], read_files)
+            return _validate_static_version(version)
+        if "file" in version_config:
+            files = version_config["file"]
+            files = [files] if isinstance(files, str) else files
+            return _validate_static_version(_read_version_files(files, read_files))
+
+    return _validate_static_version(spec)
+
+
+def _read_version_files(paths, read_files):
+    """Read the version from `file:` paths, or None if one cannot be read."""
+    text = ""
+    for path in paths:
+        path = Path(path.strip())  # noqa: PLW2901
+        read_files.append(path)
+        try:
+            text += path.read_text(encoding="utf-8")
+        except (OSError, ValueError):
+            return None
+    return text.strip()
+
+
+def _validate_static_version(version):
+    """Return the version if it is a valid version string, else None."""
+    if not version:
+        return None
+    try:
+        Version(version)
+    except InvalidVersion:
+        return None
+    return version
+
+
+def _get_string_constants(tree):
+    """Get the module level names that are assigned a string literal.
+
+    Names that are bound more than once anywhere in the module, for instance
+    by an augmented assignment or an assignment in an `if` block, or that are
+    bound to anything else, map to None.  Names that are only imported are
+    left out, so that they can be followed.
+    """
+    bindings: dict[str, int] = {}
+    imported = set()
+    for node in ast.walk(tree):
+        names = []
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            names = [node.id]
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            names = [alias.asname or alias.name.split(".")[0] for alias in node.names]
+            imported.update(names)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names = [node.name]
+        elif isinstance(node, (ast.ExceptHandler, ast.MatchAs, ast.MatchStar)):
+            names = [node.name] if node.name else []
+        for name in names:
+            bindings[name] = bindings.get(name, 0) + 1
+
+    constants: dict[str, str | None] = {
+        name: None for name, count in bindings.items() if count > 1 or name not in imported
+    }
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target, value = node.targets[0], node.value
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target, value = node.target, node.value
+        else:
+            continue
+        if (
+            isinstance(target, ast.Name)
+            and bindings[target.id] == 1
+            and isinstance(value, ast.Constant)
+            and isinstance(value.value, str)
+        ):
+            constants[target.id] = value.value
+    return constants
+
+
+def _find_module(name, roots):
+    """Find the source file of a module given its dotted name."""
+    for root in roots:
+        path = Path(root).joinpath(*name.split("."))
+        for candidate in [path / "__init__.py", path.with_suffix(".py")]:
+            if candidate.exists():
+                return candidate
+    return None
+
+
+def _get_attr_version(spec, read_files, depth=0):
+    """Statically resolve an `attr:` version directive such as `foo.__version__`.
+
+    Follows `from ._version import __version__` style imports.
+    """
+    module_name, _, attr = spec.rpartition(".")
+    path = _find_module(module_name, [".", "src"]) if module_name else None
+    return _get_module_attr(path, attr, read_files, depth) if path else None
+
+
+def _get_module_attr(path, attr, read_files, depth=0):
+    """Statically get a string attribute of a module."""
+    read_files.append(path)
+    try:
+        tree = ast.parse(path.read_text(encoding="utf-8"))
+    except (OSError, SyntaxError, ValueError):
+        return None
+    constants = _get_string_constants(tree)
+    if attr in constants:
+        return constants[attr]
+
+    for node in tree.body:
+        if not isinstance(node, ast.ImportFrom) or depth >= 3:
+            continue
+        for alias in node.names:
+            if (alias.asname or alias.name) != attr:
+                continue
+            if not node.level:
+                module = _find_module(node.module or "", [".", "src"])
+            else:
+                base = path.parents[node.level - 1]
+                module = _find_module(node.module, [base]) if node.module else None
+            return _get_module_attr(module, alias.name, read_files, depth + 1) if module else None
+    return None
+
+
+def _get_metadata_version():
+    """Get the version from the PEP 517 wheel metadata in an isolated build env.
+
+    Falls back to building the wheel if the backend does not implement
+    `prepare_metadata_for_build_wheel`.  Returns None if `build` is not
+    installed.
+    """
+    try:
+        from build.util import project_wheel_metadata
+    except ImportError:
+        return None
+    log("Preparing the wheel metadata to get the version")
+    metadata = project_wheel_metadata(os.getcwd(), isolated=True)
+    return metadata["Version"]
+
+
 def normalize_path(path):
     """Normalize a path to use backslashes"""
     return str(path).replace(os.sep, "/")
@@ -206,16 +736,70 @@ def normalize_path(path):
 
 def compute_sha256(path):
     """Compute the sha256 of a file"""
-    sha256 = hashlib.sha256()
+    return compute_digests(path)["sha256"]
 
+
+def compute_digests(path, algorithms=DIGEST_ALGORITHMS):
+    """Compute the digests of a file with each of `algorithms` in a single read.
+
+    Results are memoized on the path, size, modification time and inode of
+    the file and the algorithms, so a file is only hashed again if it changes.
+    """
+    algorithms = tuple(algorithms)
+    stat = os.stat(path)
+    key = (osp.abspath(path), stat.st_size, stat.st_mtime_ns, stat.st_ino, algorithms)
+    if key in _digest_cache:
+        return _digest_cache[key]
+
+    digests = _hash_file(path, stat.st_size, algorithms)
+    _digest_cache[key] = digests
+    return digests
+
+
+def _get_buffer_size(size):
+    """Get a read buffer size suited to a file size."""
+    return min(max(BUF_SIZE, 2 ** (size // 64).bit_length()), MAX_BUF_SIZE)
+
+
+def _hash_file(path, size=None, algorithms=DIGEST_ALGORITHMS):
+    """Hash a file with each of `algorithms` in a single pass."""
+    size = os.path.getsize(path) if size is None else size
+    hashes = [hashlib.new(name) for name in algorithms]
     with open(path, "rb") as f:
-        while True:
-            data = f.read(BUF_SIZE)
-            if not data:
-                break
-            sha256.update(data)
+        if size >= MMAP_THRESHOLD:
+            # Hash large files straight from the page cache.  Each window is
+            # small enough to still be in the CPU cache for any other hash.
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for start in range(0, size, MAX_BUF_SIZE):
+                        window = view[start : start + MAX_BUF_SIZE]
+                        for hash_obj in hashes:
+                            hash_obj.update(window)
+                        window.release()
+                finally:
+                    view.release()
+        else:
+            # Read into a reused buffer to avoid allocating per chunk.
+            buffer = bytearray(_get_buffer_size(size))
+            view = memoryview(buffer)
+            while True:
+                count = f.readinto(buffer)
+                if not count:
+                    break
+                for hash_obj in hashes:
+                    hash_obj.update(view[:count])
+    return {hash_obj.name: hash_obj.hexdigest() for hash_obj in hashes}
+
 
-    return sha256.hexdigest()
+def compute_digests_many(paths, max_workers=None, algorithms=DIGEST_ALGORITHMS):
+    """Compute the digests of several files on a thread pool.
+
+    Returns a dict of digests keyed by path, in the order of `paths`.
+    """
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return dict(zip(paths, pool.map(lambda path: compute_digests(path, algorithms), paths)))
 
 
 def create_release_commit(version, release_message=None, dist_dir="dist"):
@@ -230,9 +814,9 @@ def create_release_commit(version, release_message=None, dist_dir="dist"):
     if files:  # pragma: no cover
         cmd += ' -m "SHA256 hashes:"'
 
-    for path in sorted(files):
-        path = normalize_path(path)  # noqa: PLW2901
-        sha256 = compute_sha256(path)
+    digests = compute_digests_many(sorted(normalize_path(path) for path in files))
+    for path, digest in digests.items():
+        sha256 = digest["sha256"]
         shas[path] = sha256
         name = osp.basename(path)
         cmd += f' -m "{name}: {sha256}"'
@@ -250,6 +834,10 @@ def _get_hatch_version_cmd():
 
 def bump_version(version_spec, *, changelog_path="", version_cmd=""):
     """Bump the version"""
+    # Bump in process unless a version command is given explicitly, or it
+    # is an npm workspace bump, which is applied in one pass.
+    in_process = not version_cmd or _is_npm_workspaces_cmd(version_cmd)
+
     # Look for config files to determine version command if not given
     if not version_cmd:
         for name in "bumpversion", ".bumpversion", "bump2version", ".bump2version":
@@ -348,11 +936,168 @@ def bump_version(version_spec, *, changelog_path="", version_cmd=""):
                 version_spec = f"{v.major}.{v.minor + 1}.0"
 
     # Bump the version
-    run(f"{version_cmd} {version_spec}", echo=True)
+    if in_process and _bump_version_in_process(version_cmd, version_spec):
+        log(f"Bumped the version in process with spec {version_spec}")
+    else:
+        run(f"{version_cmd} {version_spec}", echo=True)
+    invalidate_version_cache()
 
     return get_version()
 
 
+def _bump_version_in_process(version_cmd, version_spec):
+    """Apply a version bump without running the version command.
+
+    Returns False if the bump needs the version command, for example
+    for hooks, custom templates or version specs that are not handled here.
+    """
+    if version_cmd == TBUMP_CMD:
+        changes = _get_tbump_changes(version_spec)
+    elif "hatch" in version_cmd:
+        changes = _get_hatch_changes(version_spec)
+    elif version_cmd.startswith("npm version"):
+        # Import here to avoid circular import.
+        from jupyter_releaser.npm import get_version_changes
+
+        changes = get_version_changes(
+            version_spec,
+            workspaces=_is_npm_workspaces_cmd(version_cmd),
+            include_root="--include-workspace-root" in version_cmd.split(),
+        )
+    else:
+        changes = None
+
+    if not changes:
+        return False
+    write_files_atomic(changes)
+    return True
+
+
+def _is_npm_workspaces_cmd(version_cmd):
+    """Test whether a version command is `npm version` for all workspaces."""
+    args = version_cmd.split()
+    return args[:2] == ["npm", "version"] and ("--workspaces" in args or "-ws" in args)
+
+
+def read_text_file(path):
+    """Read a text file, keeping its line endings."""
+    with open(path, encoding="utf-8", newline="") as fid:
+        return fid.read()
+
+
+def write_files_atomic(contents):
+    """Write text files so that none of them is changed if any write fails.
+
+    The new contents are written to temporary files next to their targets,
+    which are then renamed over the targets.
+    """
+    temp_files = []
+    try:
+        for path, text in contents.items():
+            path = Path(path)  # noqa: PLW2901
+            fd, temp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+            temp_files.append((temp_path, path))
+            with open(fd, "w", encoding="utf-8", newline="") as fid:
+                fid.write(text)
+            if path.exists():
+                shutil.copymode(path, temp_path)
+    except BaseException:
+        for temp_path, _ in temp_files:
+            os.remove(temp_path)
+        raise
+
+    for temp_path, path in temp_files:
+        os.replace(temp_path, path)
+
+
+def _get_tbump_changes(version_spec):
+    """Get the files changed by `tbump --only-patch`."""
+    config_path = Path("tbump.toml")
+    if config_path.exists():
+        config = toml.loads(config_path.read_text(encoding="utf-8"))
+    else:
+        config_path = PYPROJECT
+        config = toml.loads(PYPROJECT.read_text(encoding="utf-8"))["tool"]["tbump"]
+
+    current = config.get("version", {}).get("current")
+    regex = config.get("version", {}).get("regex")
+    if not current or not regex or not re.fullmatch(regex, version_spec, re.VERBOSE):
+        return None
+
+    # Update the current version in the config.
+    text = read_text_file(config_path)
+    pattern = r"^(\s*current\s*=\s*)([\"'])" + re.escape(current) + r"\2"
+    replacement = r"\g<1>\g<2>" + version_spec + r"\g<2>"
+    text, count = re.subn(pattern, replacement, text, count=1, flags=re.M)
+    if not count:
+        return None
+    changes = {str(config_path): text}
+
+    # Replace the version on the lines matching the search of each file.
+    for file_config in config.get("file", []):
+        if "version_template" in file_config:
+            return None
+        search = file_config.get("search", "{current_version}")
+        search = search.format(current_version=re.escape(current))
+        found = False
+        for path in glob(file_config["src"], recursive=True):
+            path = normalize_path(path)  # noqa: PLW2901
+            text = changes.get(path) or read_text_file(path)
+            lines = text.splitlines(keepends=True)
+            for index, line in enumerate(lines):
+                if current in line and re.search(search, line):
+                    lines[index] = line.replace(current, version_spec)
+                    found = True
+            changes[path] = "".join(lines)
+        # Let tbump report files where the current version is not found.
+        if not found:
+            return None
+    return changes
+
+
+def _get_hatch_changes(version_spec):
+    """Get the files changed by `hatch version` for an explicit version."""
+    try:
+        version = str(Version(version_spec))
+    except InvalidVersion:
+        return None
+
+    text = read_text_file(PYPROJECT)
+    data = toml.loads(text)
+
+    # Update a static version in the project table.
+    if data.get("project", {}).get("version"):
+        start = re.search(r"^\[project\]\s*$", text, re.M)
+        if not start:
+            return None
+        end = re.search(r"^\[", text[start.end() :], re.M)
+        stop = start.end() + end.start() if end else len(text)
+        table = text[start.end() : stop]
+        replacement = r"\g<1>\g<2>" + version + r"\g<2>"
+        pattern = r"^(version\s*=\s*)([\"']).+?\2"
+        table, count = re.subn(pattern, replacement, table, count=1, flags=re.M)
+        if not count:
+            return None
+        return {str(PYPROJECT): text[: start.end()] + table + text[stop:]}
+
+    # Update the version in the file read by the regex version source.
+    config = data.get("tool", {}).get("hatch", {}).get("version", {})
+    if config.get("source", "regex") != "regex" or not config.get("path"):
+        return None
+    path = Path(config["path"])
+    version_pattern = config.get("pattern")
+    if not isinstance(version_pattern, str):
+        version_pattern = HATCH_VERSION_PATTERN
+    contents = read_text_file(path)
+    match = re.search(version_pattern, contents, re.M)
+    if not match:
+        return None
+    if config.get("validate-bump", True) and Version(version) <= Version(match.group("version")):
+        return None
+    contents = contents[: match.start("version")] + version + contents[match.end("version") :]
+    return {str(path): contents}
+
+
 def is_prerelease(version):
     """Test whether a version is a prerelease version"""
     match = re.match("([0-9]+.[0-9]+.[0-9]+)", version)
@@ -362,35 +1107,80 @@ def is_prerelease(version):
 
 
 def release_for_url(gh, url):
-    """Get release response data given a release url"""
-    release = None
-    for rel in gh.repos.list_releases():
+    """Get release response data given a release url
+
+    The release is fetched directly by the id or tag in the url, falling
+    back to scanning every page of releases, which also finds drafts.
+    """
+    try:
+        release = _get_release_direct(gh, url)
+        if release and url in (release.html_url, release.url):
+            return release
+    except HTTP404NotFoundError:
+        pass
+
+    for rel in iter_releases(gh):
         if url in (rel.html_url, rel.url):
-            release = rel
-    if not release:
-        msg = f"No release found for url {url}"
-        raise ValueError(msg)
-    return release
+            return rel
+    msg = f"No release found for url {url}"
+    raise ValueError(msg)
+
+
+def _get_release_direct(gh, url):
+    """Get a release by the id or tag in its url, if there is one."""
+    match = re.search(RELEASE_ID_PATTERN, url)
+    if match:
+        return gh.repos.get_release(match["id"])
+    try:
+        match = parse_release_url(url)
+    except ValueError:
+        return None
+    tag = unquote(match["tag"])
+    # Draft releases get a placeholder tag that cannot be looked up.
+    if tag.startswith("untagged-"):
+        return None
+    return gh.repos.get_release_by_tag(tag)
+
+
+def iter_releases(gh, per_page=None):
+    """Iterate over every release of a repo, newest first."""
+    for releases in iter_release_pages(gh, per_page):
+        yield from releases
+
+
+def iter_release_pages(gh, per_page=None):
+    """Iterate over the pages of releases of a repo, newest first."""
+    per_page = per_page or RELEASES_PER_PAGE
+    page = 1
+    while True:
+        releases = gh.repos.list_releases(per_page=per_page, page=page)
+        yield releases
+        if len(releases) < per_page:
+            return
+        page += 1
 
 
 def latest_draft_release(gh, branch=None):
     """Get the latest draft release for a given repo"""
-    newest_time = None
     newest_release = None
     if branch:
         log(f"Getting latest draft release on branch {branch}")
     else:
         log("Getting latest draft release")
-    for release in gh.repos.list_releases():
-        if str(release.draft).lower() == "false":
-            continue
-        if branch and release.target_commitish != branch:
-            continue
-        created = release.created_at
-        d_created = datetime.strptime(created, r"%Y-%m-%dT%H:%M:%SZ")
-        if newest_time is None or d_created > newest_time:  # type:ignore[unreachable]
-            newest_time = d_created
-            newest_release = release
+    for releases in iter_release_pages(gh):
+        for release in releases:
+            if str(release.draft).lower() == "false":
+                continue
+            if branch and release.target_commitish != branch:
+                continue
+            # The timestamps are all in the same ISO 8601 format, so they
+            # sort as strings.
+            if newest_release is None or release.created_at > newest_release.created_at:  # type:ignore[unreachable]
+                newest_release = release
+        # Releases are listed newest first, so later pages only hold older
+        # releases.
+        if newest_release:
+            break
     if not newest_release:
         log("No draft release found!")
     else:
@@ -489,17 +1279,140 @@ def parse_release_url(release_url):
     return match
 
 
-def fetch_release_asset(target_dir, asset, auth):
-    """Fetch a release asset into a target directory."""
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Get the shared HTTP session.
+
+    The session keeps connections alive between requests, with a pool
+    sized for concurrent transfers, and retries idempotent requests that
+    fail with a server error.
+    """
+    global _session  # noqa: PLW0603
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                connect=1,
+                backoff_factor=0.5,
+                status_forcelist=(500, 502, 503, 504),
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=4, pool_maxsize=MAX_TRANSFER_WORKERS, max_retries=retry
+            )
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def set_session(session):
+    """Set the shared HTTP session, or reset it with None."""
+    global _session  # noqa: PLW0603
+    with _session_lock:
+        _session = session
+
+
+class _ByteBudget:
+    """Limit the total number of bytes held by concurrent transfers."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.available = limit
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        """Wait until `size` bytes are available and reserve them."""
+        size = min(size, self.limit)
+        with self._condition:
+            self._condition.wait_for(lambda: self.available >= size)
+            self.available -= size
+        return size
+
+    def release(self, size):
+        """Return reserved bytes to the budget."""
+        with self._condition:
+            self.available += size
+            self._condition.notify_all()
+
+
+def fetch_release_assets(
+    target_dir,
+    assets,
+    auth,
+    asset_shas=None,
+    max_workers=MAX_TRANSFER_WORKERS,
+    max_bytes_in_flight=MAX_BYTES_IN_FLIGHT,
+):
+    """Fetch release assets into a target directory concurrently.
+
+    Downloads share the pooled session from `get_session`, each asset is
+    retried on connection errors, and the total size of the assets being downloaded at once is
+    bounded by `max_bytes_in_flight`.  Assets are verified against
+    `asset_shas` as they are downloaded.  Returns the fetched paths in the
+    order of `assets`.
+    """
+    asset_shas = asset_shas or {}
+    budget = _ByteBudget(max_bytes_in_flight)
+
+    def fetch(asset):
+        reserved = budget.acquire(getattr(asset, "size", 0) or 0)
+        try:
+            for attempt in range(DOWNLOAD_RETRIES + 1):
+                try:
+                    return fetch_release_asset(target_dir, asset, auth, asset_shas.get(asset.name))
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt == DOWNLOAD_RETRIES:
+                        raise
+                    log(f"Retrying {asset.name} after error: {e}")
+                    time.sleep(2**attempt)
+        finally:
+            budget.release(reserved)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(fetch, asset) for asset in assets]
+        try:
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def fetch_release_asset(target_dir, asset, auth, sha256=None):
+    """Fetch a release asset into a target directory.
+
+    The asset is hashed as it is downloaded.  If an expected `sha256` is
+    given and does not match, or more bytes arrive than the asset size,
+    the file is removed and a ValueError is raised.
+    """
     log(f"Fetching {asset.name}...")
     url = asset.url
     headers = {"Authorization": f"token {auth}", "Accept": "application/octet-stream"}
     path = Path(target_dir) / asset.name
-    with requests.get(url, headers=headers, stream=True, timeout=60) as r:
-        r.raise_for_status()
-        with open(path, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                f.write(chunk)
+    size = getattr(asset, "size", 0) or 0
+    hash_obj = hashlib.sha256()
+    received = 0
+    try:
+        with get_session().get(url, headers=headers, stream=True, timeout=60) as r:
+            r.raise_for_status()
+            with open(path, "wb") as f:
+                for chunk in r.iter_content(chunk_size=_get_buffer_size(size)):
+                    received += len(chunk)
+                    if sha256 and size and received > size:
+                        msg = f"{asset.name} is larger than its size of {size} bytes"
+                        raise ValueError(msg)
+                    hash_obj.update(chunk)
+                    f.write(chunk)
+        if sha256 and hash_obj.hexdigest() != sha256:
+            msg = f"sha for {asset.name} does not match asset_shas file"
+            raise ValueError(msg)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
     return path
 
 
@@ -510,7 +1423,7 @@ def fetch_release_asset_data(asset, auth):
     headers = {"Authorization": f"token {auth}", "Accept": "application/octet-stream"}
 
     sink = BytesIO()
-    with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+    with get_session().get(url, headers=headers, stream=True, timeout=60) as r:
         r.raise_for_status()
         for chunk in r.iter_content(chunk_size=8192):
             sink.write(chunk)
@@ -518,20 +1431,79 @@ def fetch_release_asset_data(asset, auth):
     return json.loads(sink.read().decode("utf-8"))
 
 
-def upload_assets(gh, assets, release, auth):  # noqa: ARG001
-    """Upload assets to a release."""
+def upload_release_asset(gh, release, fpath):
+    """Upload a file to a release.
+
+    Unlike `gh.upload_file`, the file is streamed from disk with an explicit
+    Content-Length rather than read into memory first.  The upload goes
+    through the GitHub rate limiter like the other API requests, and is
+    retried if it hits a rate limit.
+    """
+    fpath = Path(fpath)
+    url = release.upload_url.replace("{?name,label}", "")
+    headers = {
+        **gh.headers,
+        "Content-Type": mimetypes.guess_type(fpath, False)[0] or "application/octet-stream",
+        "Content-Length": str(fpath.stat().st_size),
+    }
+    for attempt in range(GITHUB_RATE_LIMIT_RETRIES + 1):
+        with github_rate_limiter, open(fpath, "rb") as f:
+            r = get_session().post(
+                url, params={"name": fpath.name}, headers=headers, data=f, timeout=60
+            )
+        github_rate_limiter.update(r.headers)
+        delay = None if r.ok else github_rate_limiter.retry_delay(r.status_code, r.headers, r.text)
+        if delay is None or attempt == GITHUB_RATE_LIMIT_RETRIES:
+            break
+        log(f"Hit the GitHub rate limit, retrying in {delay:.0f} seconds")
+        github_rate_limit_stats["retries"] += 1
+        time.sleep(delay)
+    r.raise_for_status()
+    return r.json() if r.content else None
+
+
+def upload_assets(gh, assets, release, auth, max_workers=None):  # noqa: ARG001
+    """Upload assets to a release concurrently.
+
+    At most `max_workers` assets are uploaded at once, defaulting to the
+    RH_UPLOAD_WORKERS environment variable or MAX_TRANSFER_WORKERS.  The
+    assets are hashed while they upload, and the `asset_shas.json` file is
+    uploaded last, once every asset has been uploaded.
+    """
+    if max_workers is None:
+        value = os.environ.get(UPLOAD_WORKERS_ENV) or MAX_TRANSFER_WORKERS
+        try:
+            max_workers = int(value)
+        except ValueError:
+            msg = f"{UPLOAD_WORKERS_ENV} must be a whole number of uploads, got {value!r}"
+            raise ValueError(msg) from None
+    # More workers than pooled connections would open connections that the
+    # session pool discards.
+    max_workers = max(1, min(max_workers, MAX_TRANSFER_WORKERS))
     log(f"Uploading assets: {assets}")
-    asset_shas = {}
-    for fpath in assets:
-        gh.upload_file(release, fpath)
-        asset_shas[os.path.basename(fpath)] = compute_sha256(fpath)
+    assets = list(assets)
+
+    with ThreadPoolExecutor(max_workers=1) as hasher:
+        hashing = hasher.submit(compute_digests_many, assets)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(upload_release_asset, gh, release, fpath) for fpath in assets]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        digests = hashing.result()
+
+    asset_shas = {os.path.basename(fpath): digests[fpath]["sha256"] for fpath in assets}
 
     # Create an asset_shas file.
     with tempfile.TemporaryDirectory() as td:
         asset_shas_file = os.path.join(td, "asset_shas.json")
         with open(asset_shas_file, "w") as fid:
             json.dump(asset_shas, fid)
-        gh.upload_file(release, asset_shas_file)
+        upload_release_asset(gh, release, asset_shas_file)
 
     return release
 
@@ -671,12 +1643,282 @@ def ensure_sha(dry_run, expected_sha, branch):
             raise RuntimeError(msg)
 
 
+def get_cache_dir():
+    """Get the directory used to cache GitHub responses."""
+    name = "jupyter_releaser_cache"
+    # The temporary directory is shared between users on POSIX.
+    if hasattr(os, "getuid"):
+        name += f"-{os.getuid()}"
+    default = os.path.join(tempfile.gettempdir(), name)
+    return Path(os.environ.get(CACHE_DIR_ENV) or default)
+
+
+def _ensure_private_dir(path):
+    """Create a directory, and any missing parents, that only the current
+    user can access.
+
+    Returns False if an existing directory is owned by another user or is
+    writable by others, and so cannot be trusted.
+    """
+    path = Path(path)
+    for directory in [*reversed(path.parents), path]:
+        if not directory.exists():
+            directory.mkdir(mode=0o700, exist_ok=True)
+    if not hasattr(os, "getuid"):  # pragma: no cover
+        return True
+    stat = path.stat()
+    return stat.st_uid == os.getuid() and not stat.st_mode & 0o022
+
+
+class _ResponseCache:
+    """An on-disk store of responses, evicting the least recently used
+    entries once their total size exceeds `max_size`."""
+
+    def __init__(self, directory, max_size):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._sizes: OrderedDict[str, int] = OrderedDict()
+        # Responses may hold private data, and are trusted when read back.
+        self.enabled = _ensure_private_dir(self.directory)
+        if not self.enabled:
+            log(f"Not caching GitHub responses, {self.directory} is not private to this user")
+        else:
+            paths = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+            for path in paths:
+                self._sizes[path.name] = path.stat().st_size
+        self.size = sum(self._sizes.values())
+
+    def _path(self, key):
+        return self.directory / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, key):
+        """Get the entry for a key, or None."""
+        path = self._path(key)
+        with self._lock:
+            if not self.enabled or path.name not in self._sizes:
+                return None
+            try:
+                entry = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                self.size -= self._sizes.pop(path.name)
+                path.unlink(missing_ok=True)
+                return None
+            self._sizes.move_to_end(path.name)
+            os.utime(path)
+        return entry
+
+    def put(self, key, entry):
+        """Store the entry for a key, evicting old entries if needed."""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        text = json.dumps(entry)
+        with self._lock:
+            write_files_atomic({path: text})
+            self.size += len(text) - self._sizes.pop(path.name, 0)
+            self._sizes[path.name] = len(text)
+            while self.size > self.max_size and len(self._sizes) > 1:
+                name, size = self._sizes.popitem(last=False)
+                (self.directory / name).unlink(missing_ok=True)
+                self.size -= size
+                github_cache_stats["evictions"] += 1
+
+
+_github_cache: _ResponseCache | None = None
+
+
+def get_github_cache():
+    """Get the response cache for the current cache directory."""
+    global _github_cache  # noqa: PLW0603
+    directory = get_cache_dir() / "github"
+    if _github_cache is None or _github_cache.directory != directory:
+        _github_cache = _ResponseCache(directory, GITHUB_CACHE_MAX_SIZE)
+    return _github_cache
+
+
+def log_github_cache_stats():
+    """Log the hit rate of the GitHub response cache."""
+    total = github_cache_stats["hits"] + github_cache_stats["misses"]
+    if not total:
+        return
+    rate = github_cache_stats["hits"] / total
+    log(
+        f"GitHub cache: {github_cache_stats['hits']} hits, "
+        f"{github_cache_stats['misses']} misses ({rate:.0%} hit rate), "
+        f"{github_cache_stats['evictions']} evictions"
+    )
+
+
+atexit.register(log_github_cache_stats)
+
+
+class _RateLimiter:
+    """Schedule GitHub requests according to the remaining rate limit.
+
+    Fewer requests are allowed to run at once as the remaining budget
+    drains, and once it runs out requests wait for it to reset.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self._condition = threading.Condition()
+
+    def allowed(self):
+        """Get the number of requests allowed to run at once."""
+        if not self.limit or self.remaining is None:
+            return self.max_concurrency
+        share = self.max_concurrency * self.remaining // self.limit
+        return max(1, min(self.max_concurrency, share))
+
+    def __enter__(self):
+        if self.remaining == 0 and self.reset:
+            wait = self.reset - time.time() + 1
+            if 0 < wait <= GITHUB_MAX_RATE_LIMIT_WAIT:
+                log(f"GitHub rate limit exhausted, waiting {wait:.0f} seconds for it to reset")
+                github_rate_limit_stats["throttled"] += 1
+                time.sleep(wait)
+        with self._condition:
+            if self.active >= self.allowed():
+                github_rate_limit_stats["throttled"] += 1
+            self._condition.wait_for(lambda: self.active < self.allowed())
+            self.active += 1
+            github_rate_limit_stats["requests"] += 1
+        return self
+
+    def __exit__(self, *args):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def update(self, headers):
+        """Update the remaining budget from the headers of a response."""
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if "x-ratelimit-remaining" not in headers:
+            return
+        with self._condition:
+            self.remaining = int(headers["x-ratelimit-remaining"])
+            self.limit = int(headers.get("x-ratelimit-limit") or 0) or self.limit
+            self.reset = int(headers.get("x-ratelimit-reset") or 0) or self.reset
+            self._condition.notify_all()
+
+    def retry_delay(self, status, headers, message=""):
+        """Get how long to wait before retrying a rate limited request, or
+        None if the error response is not due to a rate limit."""
+        if status not in (403, 429):
+            return None
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if headers.get("retry-after"):
+            delay = float(headers["retry-after"])
+        elif headers.get("x-ratelimit-remaining") == "0" and headers.get("x-ratelimit-reset"):
+            delay = int(headers["x-ratelimit-reset"]) - time.time() + 1
+        elif status == 429 or "rate limit" in message.lower():
+            delay = GITHUB_SECONDARY_RATE_LIMIT_WAIT
+        else:
+            return None
+        if delay > GITHUB_MAX_RATE_LIMIT_WAIT:
+            return None
+        return max(delay, 0)
+
+
+github_rate_limiter = _RateLimiter(GITHUB_MAX_CONCURRENCY)
+
+
+def log_github_rate_limit_stats():
+    """Log how the GitHub requests were scheduled."""
+    if not github_rate_limit_stats["requests"]:
+        return
+    log(
+        f"GitHub requests: {github_rate_limit_stats['requests']}, "
+        f"{github_rate_limit_stats['retries']} retries, "
+        f"{github_rate_limit_stats['throttled']} throttled, "
+        f"{github_rate_limiter.remaining} remaining"
+    )
+
+
+atexit.register(log_github_rate_limit_stats)
+
+
+class CachedGhApi(core.GhApi):  # type:ignore[misc]
+    """A GhApi that caches GET responses on disk and schedules requests
+    around the rate limit.
+
+    Cached responses are revalidated with their ETag or Last-Modified date,
+    and are served from the cache when GitHub answers with a 304, which does
+    not count against the rate limit.  Requests that hit a rate limit are
+    retried once it allows.
+    """
+
+    def __call__(self, path, verb=None, headers=None, route=None, query=None, data=None):
+        """Call a GitHub API endpoint, using the cache for GET requests."""
+        if (verb or ("POST" if data else "GET")).upper() != "GET":
+            return self._send(path, verb, headers, route, query, data)
+
+        headers = {**self.headers, **(headers or {})}
+        if "json" not in headers["Accept"]:
+            return self._send(path, verb, headers, route, query, data)
+
+        cache = get_github_cache()
+        key = json.dumps([self.gh_host, path, route, query, headers], sort_keys=True, default=str)
+        entry = cache.get(key)
+        request_headers = dict(headers)
+        if entry and entry["etag"]:
+            request_headers["If-None-Match"] = entry["etag"]
+        elif entry:
+            request_headers["If-Modified-Since"] = entry["last_modified"]
+
+        try:
+            res = self._send(path, verb, request_headers, route, query, data)
+        except HTTPError as e:
+            if entry is None or e.code != 304:
+                raise
+            self.recv_hdrs = dict(e.headers)
+            github_cache_stats["hits"] += 1
+            return dict2obj(entry["data"])
+        github_cache_stats["misses"] += 1
+
+        # The header names keep the case the server sent them in.
+        recv_hdrs = {k.lower(): v for k, v in self.recv_hdrs.items()}
+        etag, last_modified = recv_hdrs.get("etag"), recv_hdrs.get("last-modified")
+        if etag or last_modified:
+            entry = {"etag": etag, "last_modified": last_modified, "data": obj2dict(res)}
+            cache.put(key, entry)
+        return res
+
+    def _send(self, path, verb, headers, route, query, data):
+        """Send a request through the rate limiter, retrying it if it hits
+        a rate limit."""
+        for attempt in range(GITHUB_RATE_LIMIT_RETRIES + 1):
+            with github_rate_limiter:
+                try:
+                    # GhApi quotes the route in place, so pass it a copy.
+                    res = super().__call__(
+                        path, verb, headers, dict(route) if route else route, query, data
+                    )
+                except HTTPError as e:
+                    github_rate_limiter.update(e.headers)
+                    delay = github_rate_limiter.retry_delay(e.code, e.headers, str(e))
+                    if delay is None or attempt == GITHUB_RATE_LIMIT_RETRIES:
+                        raise
+                else:
+                    github_rate_limiter.update(self.recv_hdrs)
+                    return res
+            log(f"Hit the GitHub rate limit, retrying in {delay:.0f} seconds")
+            github_rate_limit_stats["retries"] += 1
+            time.sleep(delay)
+        return None
+
+
 def get_gh_object(dry_run=False, **kwargs):
     """Get a properly configured GhAPi object"""
     if dry_run:
         ensure_mock_github()
 
-    return core.GhApi(**kwargs)
+    return CachedGhApi(**kwargs)
 
 
 _local_remote = None
@@ -717,7 +1959,7 @@ def ensure_mock_github():
     log("Ensuring mock GitHub")
     # First see if it is already running.
     try:
-        requests.get(host, timeout=60)
+        get_session().get(host, timeout=60)
         return None
     except requests.ConnectionError:
         pass
@@ -746,7 +1988,7 @@ def ensure_mock_github():
 
     while 1:
         try:
-            requests.get(host, timeout=60)
+            get_session().get(host, timeout=60)
             break
         except requests.ConnectionError:
             pass
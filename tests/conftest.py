@@ -27,7 +27,7 @@ def github_port(worker_id):
 
 
 @pytest.fixture(autouse=True)
-def mock_env(mocker):
+def mock_env(mocker, tmp_path_factory):
     """Clear unwanted environment variables"""
     # Anything that starts with RH_ or GITHUB_ or PIP
     # Also clear HATCH_ENV_ACTIVE to prevent hatch 1.16+ from inheriting
@@ -39,6 +39,9 @@ def mock_env(mocker):
             if key.startswith(prefix):
                 del env[key]
 
+    # Do not share cached GitHub responses between tests.
+    env[util.CACHE_DIR_ENV] = str(tmp_path_factory.mktemp("cache"))
+
     mocker.patch.dict(os.environ, env, clear=True)
     return
 
@@ -243,6 +246,16 @@ def mock_github():
         proc.wait()
 
 
+@pytest.fixture()
+def asset_files(tmp_path):
+    files = []
+    for i in range(4):
+        path = tmp_path / f"foo{i}.tar.gz"
+        path.write_bytes(os.urandom(50_000))
+        files.append(path)
+    return files
+
+
 @pytest.fixture()
 def release_metadata():
     return dict(
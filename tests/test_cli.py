@@ -34,6 +34,8 @@ def test_prep_git_simple(py_package, runner):
 
     os.chdir(util.CHECKOUT_NAME)
     assert util.get_branch() == "bar", util.get_branch()
+    assert Path(".git/refs/remotes/origin/HEAD").exists()
+    assert util.get_default_branch() == "bar"
 
 
 def test_prep_git_pr(py_package, runner):
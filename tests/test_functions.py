@@ -1,15 +1,28 @@
 # Copyright (c) Jupyter Development Team.
 # Distributed under the terms of the Modified BSD License.
+import asyncio
+import hashlib
 import json
 import os
 import shutil
+import signal
+import subprocess
+import sys
+import threading
 import time
+import tracemalloc
+import uuid
 from pathlib import Path
+from subprocess import CalledProcessError, TimeoutExpired
+from urllib.error import HTTPError
 
+import pytest
+import requests
 import toml
+import urllib3
 from ghapi.core import GhApi
 
-from jupyter_releaser import changelog, npm, util
+from jupyter_releaser import changelog, npm, tee, util
 from jupyter_releaser.changelog import DEFAULT_IGNORED_CONTRIBUTORS
 from jupyter_releaser.util import run
 from tests import util as testutil
@@ -21,6 +34,28 @@ def test_get_branch(git_repo):
     assert util.get_branch() == "foo"
 
 
+def test_get_default_branch(git_repo, mocker):
+    # Resolved from the local refs/remotes/origin/HEAD.
+    assert util.get_default_branch() == "foo"
+
+    # Without it, the remote is asked once and the answer is cached, but
+    # not when the remote could not be reached.
+    run("git remote set-head origin -d")
+    failures = [CalledProcessError(128, "git remote show origin")]
+
+    def flaky_run(cmd, **kwargs):
+        if cmd == "git remote show origin" and failures:
+            raise failures.pop()
+        return run(cmd, **kwargs)
+
+    mocker.patch.object(util, "run", flaky_run)
+    with pytest.raises(CalledProcessError):
+        util.get_default_branch()
+    assert util.get_default_branch() == "bar"
+    run("git checkout foo")
+    assert util.get_default_branch() == "bar"
+
+
 def test_get_repo(git_repo, mocker):
     repo = f"{git_repo.parent.name}/{git_repo.name}"
     assert util.get_repo() == repo
@@ -32,6 +67,111 @@ def test_get_version_pyproject_hatch(py_package):
     assert util.get_version() == "0.0.2a0"
 
 
+def test_get_version_cache(py_package, mocker):
+    resolve = mocker.spy(util, "_get_version")
+    assert util.get_version() == "0.0.1"
+    assert util.get_version() == "0.0.1"
+    assert resolve.call_count == 1
+
+    # Editing the file that hatch reads the version from is picked up.
+    foopy = py_package / "foo.py"
+    foopy.write_text('__version__ = "0.0.2"\n', encoding="utf-8")
+    assert util.get_version() == "0.0.2"
+    assert resolve.call_count == 2
+
+
+def test_get_version_metadata(git_repo, mocker):
+    pyproject = git_repo / "pyproject.toml"
+    pyproject.write_text(
+        """
+[build-system]
+requires = ["flit_core>=3.2"]
+build-backend = "flit_core.buildapi"
+
+[project]
+name = "foo"
+dynamic = ["version", "description"]
+""",
+        encoding="utf-8",
+    )
+    foopy = git_repo / "foo.py"
+    foopy.write_text(
+        '"""My package description"""\n' + testutil.PY_MODULE_TEMPLATE, encoding="utf-8"
+    )
+
+    spy = mocker.spy(util, "run")
+    assert util.get_version() == "0.0.1"
+    assert not any("pyproject-build" in call.args[0] for call in spy.call_args_list)
+
+    # Without build, the version comes from building the wheel instead.
+    mocker.patch.dict(sys.modules, {"build.util": None})
+    assert util._get_metadata_version() is None
+
+
+def test_get_version_setuptools_static(git_repo, mocker):
+    setuppy = git_repo / "setup.py"
+    setuppy.write_text(testutil.SETUP_PY_TEMPLATE, encoding="utf-8")
+    setupcfg = git_repo / "setup.cfg"
+    setupcfg.write_text(testutil.setup_cfg_template(), encoding="utf-8")
+    foopy = git_repo / "foo.py"
+    foopy.write_text(testutil.PY_MODULE_TEMPLATE, encoding="utf-8")
+
+    spy = mocker.spy(util, "run")
+    assert util.get_version() == "0.0.1"
+    assert spy.call_count == 0
+
+    # Follow imports in a package.
+    foopy.unlink()
+    package = git_repo / "foo"
+    package.mkdir()
+    (package / "__init__.py").write_text("from ._version import __version__\n", encoding="utf-8")
+    (package / "_version.py").write_text('__version__ = "0.1.0"\n', encoding="utf-8")
+    assert util.get_version() == "0.1.0"
+
+    # Edits to the files that were read are picked up.
+    (package / "_version.py").write_text('__version__ = "0.1.1"\n', encoding="utf-8")
+    assert util.get_version() == "0.1.1"
+    assert spy.call_count == 0
+
+    # Literal versions in setup.py.
+    setupcfg.unlink()
+    setuppy.write_text(
+        'from setuptools import setup\nVERSION = "1.0"\nsetup(version=VERSION)\n', encoding="utf-8"
+    )
+    assert util.get_version() == "1.0"
+    assert spy.call_count == 0
+
+    # Names that are bound again anywhere are left to setuptools.
+    setuppy.write_text(
+        "from setuptools import setup\n"
+        'VERSION = "1.0.0"\n'
+        'if "dev" not in VERSION:\n'
+        '    VERSION += ".dev0"\n'
+        "setup(version=VERSION)\n",
+        encoding="utf-8",
+    )
+    assert util._get_static_version() is None
+    assert util.get_version() == "1.0.0.dev0"
+
+    # Computed versions and missing files are left to setuptools.
+    (package / "_version.py").write_text(
+        'version_info = (0, 2, 0)\n__version__ = ".".join(map(str, version_info))\n',
+        encoding="utf-8",
+    )
+    setupcfg.write_text(testutil.setup_cfg_template(), encoding="utf-8")
+    setuppy.write_text(testutil.SETUP_PY_TEMPLATE, encoding="utf-8")
+    assert util._get_static_version() is None
+    assert util.get_version() == "0.2.0"
+
+    setupcfg.write_text(
+        testutil.setup_cfg_template().replace("attr: foo.__version__", "file: VERSION"),
+        encoding="utf-8",
+    )
+    assert util._get_static_version() is None
+    (git_repo / "VERSION").write_text("0.3.0\n", encoding="utf-8")
+    assert util.get_version() == "0.3.0"
+
+
 def test_get_version_multipython(py_multipackage):
     prev_dir = os.getcwd()
     for package in py_multipackage:
@@ -266,6 +406,48 @@ def test_compute_sha256(py_package):
     assert len(util.compute_sha256(py_package / "CHANGELOG.md")) == 64
 
 
+def test_compute_digests(tmp_path, mocker):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"file{i}.txt"
+        path.write_bytes(os.urandom(100_000))
+        paths.append(str(path))
+
+    digests = util.compute_digests_many(paths, max_workers=2)
+    assert list(digests) == paths
+    for path in paths:
+        data = Path(path).read_bytes()
+        assert digests[path] == {"sha256": hashlib.sha256(data).hexdigest()}
+
+    # Other algorithms are only computed when asked for.
+    digests = util.compute_digests_many(paths, max_workers=2, algorithms=("sha256", "sha512"))
+    for path in paths:
+        data = Path(path).read_bytes()
+        assert digests[path]["sha512"] == hashlib.sha512(data).hexdigest()
+
+    # Unchanged files are not hashed again.
+    new = mocker.spy(util.hashlib, "new")
+    assert util.compute_sha256(paths[0]) == digests[paths[0]]["sha256"]
+    assert new.call_count == 0
+
+    Path(paths[0]).write_text("changed", encoding="utf-8")
+    assert util.compute_sha256(paths[0]) == hashlib.sha256(b"changed").hexdigest()
+
+
+def test_hash_file_mmap(tmp_path, monkeypatch):
+    path = tmp_path / "large.bin"
+    data = os.urandom(300_000)
+    path.write_bytes(data)
+    expected = util._hash_file(path, algorithms=("sha256", "sha512"))
+    assert expected["sha512"] == hashlib.sha512(data).hexdigest()
+
+    monkeypatch.setattr(util, "MMAP_THRESHOLD", 100_000)
+    monkeypatch.setattr(util, "MAX_BUF_SIZE", 2**16)
+    assert util._hash_file(path, algorithms=("sha256", "sha512")) == expected
+    assert util._get_buffer_size(0) == util.BUF_SIZE
+    assert util._get_buffer_size(2**40) == util.MAX_BUF_SIZE
+
+
 def test_create_release_commit(py_package, build_mock):
     util.bump_version("0.0.2a0")
     version = util.get_version()
@@ -341,6 +523,67 @@ def test_bump_version_dev(py_package):
     assert util.get_version() == "0.1.0"
 
 
+def test_bump_version_in_process(py_package, mocker):
+    spy = mocker.spy(util, "run")
+    util.bump_version("0.0.2")
+    assert util.get_version() == "0.0.2"
+
+    tbump = py_package / "tbump.toml"
+    tbump.write_text(testutil.TBUMP_PY_TEMPLATE, encoding="utf-8")
+    util.bump_version("0.1.0")
+    assert 'current = "0.1.0"' in tbump.read_text(encoding="utf-8")
+    assert util.get_version() == "0.1.0"
+
+    commands = [call.args[0] for call in spy.call_args_list]
+    assert not any(cmd.endswith(("0.0.2", "0.1.0")) for cmd in commands), commands
+
+
+def test_bump_version_npm_in_process(npm_package, mocker):
+    lock = npm_package / "package-lock.json"
+    data = {"version": "1.0.0", "packages": {"": {"version": "1.0.0"}}}
+    lock.write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+
+    spy = mocker.spy(util, "run")
+    util.bump_version("patch")
+    assert util.get_version() == "1.0.1"
+    data = json.loads(lock.read_text(encoding="utf-8"))
+    assert data["version"] == data["packages"][""]["version"] == "1.0.1"
+    assert not any("npm version" in call.args[0] for call in spy.call_args_list)
+
+
+def test_bump_version_npm_workspaces(workspace_package, mocker):
+    foo_json = workspace_package / "packages" / "foo" / "package.json"
+    data = json.loads(foo_json.read_text(encoding="utf-8"))
+    data["dependencies"] = dict(bar="^1.0.0")
+    foo_json.write_text(json.dumps(data), encoding="utf-8")
+
+    spy = mocker.spy(util, "run")
+    version_cmd = "npm version --workspaces --include-workspace-root --git-tag-version false"
+    util.bump_version("1.1.0", version_cmd=version_cmd)
+    assert util.get_version() == "1.1.0"
+    assert not any("npm version" in call.args[0] for call in spy.call_args_list)
+
+    versions = {}
+    for name in ["foo", "bar", "baz"]:
+        pkg_json = workspace_package / "packages" / name / "package.json"
+        versions[name] = json.loads(pkg_json.read_text(encoding="utf-8"))
+    assert {data["version"] for data in versions.values()} == {"1.1.0"}
+    assert versions["foo"]["dependencies"] == dict(bar="^1.1.0")
+    assert versions["baz"]["dependencies"] == dict(foo="*")
+
+
+def test_write_files_atomic(tmp_path):
+    foo = tmp_path / "foo.txt"
+    foo.write_text("foo", encoding="utf-8")
+    with pytest.raises(OSError):
+        util.write_files_atomic({foo: "bar", tmp_path / "missing" / "bar.txt": "bar"})
+    assert foo.read_text(encoding="utf-8") == "foo"
+    assert os.listdir(tmp_path) == ["foo.txt"]
+
+    util.write_files_atomic({foo: "bar\r\n"})
+    assert foo.read_bytes() == b"bar\r\n"
+
+
 def test_get_config_python(py_package):
     Path(util.JUPYTER_RELEASER_CONFIG).unlink()
     text = util.PYPROJECT.read_text(encoding="utf-8")
@@ -396,6 +639,36 @@ def test_get_latest_draft_release(mock_github):
     assert latest.name == "v1.0.0"
 
 
+def test_latest_draft_release_pages(mock_github, mocker):
+    gh = util.get_gh_object(owner="foo", repo="bar")
+    branch = uuid.uuid4().hex
+    for i in range(3):
+        gh.create_release(f"v{i}", branch, f"v{i}", "body", True, True, files=[])
+        time.sleep(1)
+    for _ in range(3):
+        gh.create_release(uuid.uuid4().hex, "bar", "", "body", False, False, files=[])
+
+    # The newest draft is on the second page, so the scan stops there.
+    mocker.patch.object(util, "RELEASES_PER_PAGE", 2)
+    calls = mocker.spy(GhApi, "__call__")
+    stats = mocker.patch.dict(util.github_cache_stats, {"hits": 0, "misses": 0})
+    assert util.latest_draft_release(gh, branch).name == "v2"
+    assert calls.call_count == 2
+    assert stats["misses"] == 2
+    assert stats["hits"] == 0
+
+    # Pages are revalidated with their ETags and served from the cache.
+    assert util.latest_draft_release(gh, branch).name == "v2"
+    assert stats["misses"] == 2
+    assert stats["hits"] == 2
+
+    # A new release changes the first page.
+    gh.create_release("v3", branch, "v3", "body", True, True, files=[])
+    assert util.latest_draft_release(gh, branch).name == "v3"
+    assert stats["misses"] == 3
+    assert stats["hits"] == 2
+
+
 def test_parse_release_url():
     match = util.parse_release_url("https://github.com/foo/bar/releases/tag/fizz")
     assert match.groupdict() == {"owner": "foo", "repo": "bar", "tag": "fizz"}
@@ -417,6 +690,299 @@ def test_extract_metadata_from_release_url(mock_github, draft_release):
     assert os.environ["RH_BRANCH"] == data["branch"]
 
 
+def test_github_cache_eviction(tmp_path, mocker):
+    stats = mocker.patch.dict(util.github_cache_stats, {"evictions": 0})
+    cache = util._ResponseCache(tmp_path, 300)
+    for i in range(4):
+        cache.put(f"key{i}", {"etag": f"{i}", "data": "x" * 50})
+    assert cache.get("key0")["etag"] == "0"
+
+    # The least recently used entries are evicted first.
+    cache.put("key4", {"etag": "4", "data": "x" * 50})
+    assert cache.get("key1") is None
+    assert cache.get("key0") is not None
+    assert cache.size <= 300
+    assert stats["evictions"] == 1
+
+    # The order of use survives a restart.
+    cache = util._ResponseCache(tmp_path, 300)
+    assert cache.size == sum(path.stat().st_size for path in tmp_path.glob("*.json"))
+    cache.put("key5", {"etag": "5", "data": "x" * 50})
+    assert cache.get("key2") is None
+    assert cache.get("key0") is not None
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX permissions")
+def test_github_cache_dir(tmp_path, mocker):
+    # The default folder is per user.
+    mocker.patch.dict(os.environ, {util.CACHE_DIR_ENV: ""})
+    assert util.get_cache_dir().name == f"jupyter_releaser_cache-{os.getuid()}"
+
+    # The folder is created private to the user.
+    cache = util._ResponseCache(tmp_path / "cache" / "github", 300)
+    assert (tmp_path / "cache").stat().st_mode & 0o777 == 0o700
+    assert cache.directory.stat().st_mode & 0o777 == 0o700
+    cache.put("key", {"etag": "1"})
+    assert cache.get("key") == {"etag": "1"}
+
+    # A folder that others can write to is not trusted.
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    cache = util._ResponseCache(shared, 300)
+    cache.put("key", {"etag": "1"})
+    assert cache.get("key") is None
+    assert not list(shared.iterdir())
+
+
+def test_github_rate_limit(mocker, tmp_path):
+    stats = mocker.patch.dict(
+        util.github_rate_limit_stats, {"requests": 0, "retries": 0, "throttled": 0}
+    )
+    limiter = util._RateLimiter(4)
+    mocker.patch.object(util, "github_rate_limiter", limiter)
+    sleep = mocker.patch.object(util.time, "sleep")
+    reset = int(time.time()) + 30
+    responses = []
+
+    def call(self, *args):
+        response, headers = responses.pop(0)
+        self.recv_hdrs = headers
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    mocker.patch.object(GhApi, "__call__", call)
+    gh = util.CachedGhApi(owner="foo", repo="bar", authenticate=False)
+    url = "https://api.github.com/repos/foo/bar/pulls"
+    headers = {"X-RateLimit-Remaining": "1000", "X-RateLimit-Limit": "5000"}
+
+    # Honour Retry-After on a 429.
+    responses.append((HTTPError(url, 429, "Too Many Requests", {"Retry-After": "2"}, None), {}))
+    responses.append(({"number": 1}, headers))
+    assert gh.pulls.create("title", "head", "base") == {"number": 1}
+    sleep.assert_called_once_with(2.0)
+    assert stats["requests"] == 2
+    assert stats["retries"] == 1
+
+    # Fewer requests run at once as the budget drains.
+    assert limiter.remaining == 1000
+    assert limiter.allowed() == 1
+
+    # Other errors are raised straight away.
+    responses.append((HTTPError(url, 403, "Forbidden", {}, None), {}))
+    with pytest.raises(HTTPError):
+        gh.pulls.create("title", "head", "base")
+    assert stats["retries"] == 1
+
+    # Wait for the rate limit to reset once it has run out.
+    error_headers = {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)}
+    responses.append((HTTPError(url, 403, "Forbidden", error_headers, None), {}))
+    responses.append(({"number": 2}, {**headers, "X-RateLimit-Reset": str(reset)}))
+    sleep.reset_mock()
+    assert gh.pulls.create("title", "head", "base") == {"number": 2}
+    assert 0 < sleep.call_args[0][0] <= 31
+    assert stats["retries"] == 2
+
+    # Asset uploads go through the rate limiter too.
+    def response(status, headers, body=b""):
+        r = requests.Response()
+        r.status_code, r._content = status, body
+        r.headers.update(headers)
+        return r
+
+    session = mocker.Mock()
+    session.post.side_effect = [
+        response(429, {"Retry-After": "3"}),
+        response(201, {**headers, "X-RateLimit-Remaining": "4000"}, b'{"id": 1}'),
+    ]
+    mocker.patch.object(util, "get_session", return_value=session)
+    path = tmp_path / "foo.txt"
+    path.write_text("hello", encoding="utf-8")
+    release = util.dict2obj({"upload_url": f"{url}/assets{{?name,label}}"})
+    sleep.reset_mock()
+    assert util.upload_release_asset(gh, release, path) == {"id": 1}
+    sleep.assert_called_once_with(3.0)
+    assert session.post.call_count == 2
+    assert stats["requests"] == 7
+    assert stats["retries"] == 3
+    assert limiter.remaining == 4000
+
+
+def test_release_for_url(mock_github, mocker):
+    gh = GhApi(owner="foo", repo="bar")
+    created = [testutil.create_draft_release(uuid.uuid4().hex) for _ in range(3)]
+
+    # Releases are fetched directly by id or tag.
+    scan = mocker.spy(util, "iter_releases")
+    for release in created:
+        assert util.release_for_url(gh, release.url).id == release.id
+        assert util.release_for_url(gh, release.html_url).id == release.id
+    assert scan.call_count == 0
+
+    # Releases that cannot be fetched directly are found by scanning.
+    mocker.patch.object(util, "_get_release_direct", return_value=None)
+    assert util.release_for_url(gh, created[0].html_url).id == created[0].id
+    assert scan.call_count == 1
+
+    ids = [release.id for release in util.iter_releases(gh, per_page=2)]
+    assert len(ids) == len(set(ids))
+    assert {release.id for release in created} <= set(ids)
+
+    with pytest.raises(ValueError):
+        util.release_for_url(gh, "https://github.com/foo/bar/releases/tag/missing")
+
+    # Drafts with a placeholder tag go straight to the scan.
+    html_url = "https://github.com/foo/bar/releases/tag/untagged-1"
+    draft = util.dict2obj({"html_url": html_url, "url": ""})
+    mocker.patch.object(util, "iter_releases", return_value=[draft])
+    api = mocker.Mock()
+    assert util.release_for_url(api, draft.html_url) is draft
+    api.repos.get_release_by_tag.assert_not_called()
+
+
+def test_fetch_release_asset(mock_github, tmp_path):
+    asset_file = tmp_path / "foo.tar.gz"
+    asset_file.write_bytes(os.urandom(100_000))
+    release = testutil.create_draft_release("bar", [str(asset_file)])
+    release = util.release_for_url(GhApi(owner="foo", repo="bar"), release.url)
+    asset = next(asset for asset in release.assets if asset.name == "foo.tar.gz")
+    sha256 = util.compute_sha256(asset_file)
+
+    target = tmp_path / "dist"
+    target.mkdir()
+    path = util.fetch_release_asset(target, asset, "", sha256=sha256)
+    assert path.read_bytes() == asset_file.read_bytes()
+
+    with pytest.raises(ValueError, match="does not match"):
+        util.fetch_release_asset(target, asset, "", sha256="0" * 64)
+    assert not path.exists()
+
+
+def test_fetch_release_assets(mock_github, asset_files, tmp_path, mocker):
+    files = asset_files
+    release = testutil.create_draft_release("bar", [str(path) for path in files])
+    release = util.release_for_url(GhApi(owner="foo", repo="bar"), release.url)
+    assets = [asset for asset in release.assets if asset.name.startswith("foo")]
+    asset_shas = {path.name: util.compute_sha256(path) for path in files}
+
+    # Fail the first attempt of one asset.
+    fetch = util.fetch_release_asset
+    attempts = []
+
+    def flaky_fetch(target_dir, asset, *args, **kwargs):
+        attempts.append(asset.name)
+        if attempts.count(asset.name) == 1 and asset.name == "foo0.tar.gz":
+            raise requests.ConnectionError
+        return fetch(target_dir, asset, *args, **kwargs)
+
+    mocker.patch.object(util, "fetch_release_asset", flaky_fetch)
+    mocker.patch.object(util.time, "sleep")
+
+    target = tmp_path / "dist"
+    target.mkdir()
+    paths = util.fetch_release_assets(
+        target, assets, "", asset_shas, max_workers=2, max_bytes_in_flight=100_000
+    )
+    assert [path.name for path in paths] == [asset.name for asset in assets]
+    for path in files:
+        assert (target / path.name).read_bytes() == path.read_bytes()
+    assert attempts.count("foo0.tar.gz") == 2
+
+
+def test_upload_assets(mock_github, asset_files, mocker):
+    files = asset_files
+    gh = GhApi(owner="foo", repo="bar")
+    release = gh.create_release("bar", "bar", "bar", "body", True, True)
+
+    # Make sure two uploads are in flight at once.
+    barrier = threading.Barrier(2, timeout=10)
+    uploaded = []
+    upload_release_asset = util.upload_release_asset
+
+    def upload(gh, rel, fpath, *args):
+        if fpath in files[:2]:
+            barrier.wait()
+        uploaded.append(os.path.basename(fpath))
+        return upload_release_asset(gh, rel, fpath, *args)
+
+    mocker.patch.object(util, "upload_release_asset", upload)
+    mocker.patch.dict(os.environ, {util.UPLOAD_WORKERS_ENV: "2"})
+    util.upload_assets(gh, files, release, "")
+
+    assert sorted(uploaded[:-1]) == [os.path.basename(fpath) for fpath in files]
+    assert uploaded[-1] == "asset_shas.json"
+    release = util.release_for_url(gh, release.url)
+    asset = next(a for a in release.assets if a.name == "asset_shas.json")
+    asset_shas = util.fetch_release_asset_data(asset, "")
+    assert asset_shas == {os.path.basename(fpath): util.compute_sha256(fpath) for fpath in files}
+
+    # No more uploads run at once than the session keeps connections for.
+    executor = mocker.spy(util, "ThreadPoolExecutor")
+    mocker.patch.dict(os.environ, {util.UPLOAD_WORKERS_ENV: "64"})
+    util.upload_assets(gh, files[2:3], release, "")
+    assert executor.call_args_list[-1].kwargs["max_workers"] == util.MAX_TRANSFER_WORKERS
+
+    mocker.patch.dict(os.environ, {util.UPLOAD_WORKERS_ENV: "0"})
+    util.upload_assets(gh, files[2:3], release, "")
+    assert executor.call_args_list[-1].kwargs["max_workers"] == 1
+
+    mocker.patch.dict(os.environ, {util.UPLOAD_WORKERS_ENV: "many"})
+    with pytest.raises(ValueError, match=util.UPLOAD_WORKERS_ENV):
+        util.upload_assets(gh, files[2:3], release, "")
+
+
+def test_upload_release_asset(mock_github, tmp_path):
+    path = tmp_path / "foo.tar.gz"
+    with open(path, "wb") as f:
+        for _ in range(32):
+            f.write(os.urandom(2**20))
+    gh = GhApi(owner="foo", repo="bar")
+    release = gh.create_release("bar", "bar", "bar", "body", True, True)
+
+    # The file is streamed rather than read into memory.
+    tracemalloc.start()
+    try:
+        util.upload_release_asset(gh, release, path)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 2**22
+
+    release = util.release_for_url(gh, release.url)
+    asset = next(a for a in release.assets if a.name == path.name)
+    assert asset.size == path.stat().st_size
+    target = tmp_path / "dist"
+    target.mkdir()
+    fetched = util.fetch_release_asset(target, asset, "", util.compute_sha256(path))
+    assert fetched.read_bytes() == path.read_bytes()
+
+
+def test_get_session(mock_github, asset_files, tmp_path, mocker):
+    mocker.patch.object(util, "_session", None)
+    session = util.get_session()
+    assert util.get_session() is session
+    assert session.get_adapter("https://api.github.com").max_retries.total == util.HTTP_RETRIES
+
+    # Transfers reuse the pooled connections.
+    gh = GhApi(owner="foo", repo="bar")
+    release = gh.create_release("bar", "bar", "bar", "body", True, True)
+    new_conn = mocker.spy(urllib3.connectionpool.HTTPConnectionPool, "_new_conn")
+    util.upload_assets(gh, asset_files, release, "", max_workers=1)
+    release = util.release_for_url(gh, release.url)
+    target = tmp_path / "dist"
+    target.mkdir()
+    util.fetch_release_assets(target, release.assets, "", max_workers=1)
+    assert new_conn.call_count == 1
+
+    # The session can be replaced, for instance in tests.
+    other = requests.Session()
+    util.set_session(other)
+    assert util.get_session() is other
+    util.set_session(None)
+    assert util.get_session() not in (session, other)
+
+
 def test_prepare_environment(mock_github, draft_release):
     os.environ["GITHUB_REPOSITORY"] = "foo/bar"
     tag = draft_release.split("/")[-1]
@@ -436,3 +1002,171 @@ def test_handle_since(npm_package, runner):
     run("git tag v1.0.1", cwd=util.CHECKOUT_NAME)
     since = util.handle_since()
     assert since == "v1.0.1"
+
+
+def test_run_shared_loop(git_repo):
+    run("git status")
+    loop = tee._get_loop()
+    run("git status")
+    assert tee._get_loop() is loop
+
+
+def test_run_async():
+    async def main():
+        return await tee.run_async("echo hello", quiet=True)
+
+    result = asyncio.run(main())
+    assert result.returncode == 0
+    assert result.stdout.strip() == "hello"
+
+
+def test_run_many(capsys):
+    cmds = ["sleep 0.2 && echo first", "echo second", "python -c 'import sys; sys.exit(3)'"]
+    results = util.run_many(cmds, max_concurrency=2, check=False)
+    assert [r.returncode for r in results] == [0, 0, 3]
+    assert results[0].stdout.strip() == "first"
+    assert results[1].stdout.strip() == "second"
+    assert "[1] first" in capsys.readouterr().err
+
+    with pytest.raises(CalledProcessError) as e:
+        util.run_many(cmds)
+    assert e.value.returncode == 3
+
+
+def test_run_without_shell():
+    assert tee._get_argv('git commit -m "a message"') == ["git", "commit", "-m", "a message"]
+    assert tee._get_argv(["echo", "$HOME"]) == ["echo", "$HOME"]
+    assert tee._get_argv("echo foo >> log.txt") is None
+    assert tee._get_argv("FOO=bar env") is None
+    assert tee._get_argv("cd foo") is None
+
+    assert run(["echo", "$HOME"]) == "$HOME"
+    assert run("echo $HOME") == os.environ["HOME"]
+    with pytest.raises(CalledProcessError) as e:
+        run("this-command-does-not-exist", quiet=True)
+    assert e.value.returncode == 127
+
+
+def test_run_tail():
+    cmd = "python -c \"print('\\n'.join(str(i) for i in range(1000)))\""
+    assert run(cmd, quiet=True, tail=1) == "999"
+
+    result = tee.run(cmd, quiet=True, tail=10)
+    assert result.stdout.split() == [str(i) for i in range(990, 1000)]
+    capture = result.stdout_capture
+    assert capture.count == 1000
+    assert len(capture.lines) == 10
+    assert capture.read().split() == [str(i) for i in range(1000)]
+    capture.close()
+
+
+def test_log_sink(capsys):
+    sink = tee.LogSink(max_size=10)
+    sink.write("hello\n")
+    assert capsys.readouterr().err == ""
+    sink.write("world\n")
+    assert capsys.readouterr().err == "hello\nworld\n"
+    sink.write("foo\n")
+    sink.flush()
+    assert capsys.readouterr().err == "foo\n"
+
+    util.log("bar", "baz")
+    assert capsys.readouterr().err == "bar baz\n"
+
+
+def test_run_trace(tmp_path, monkeypatch):
+    trace_file = tmp_path / "trace.jsonl"
+    monkeypatch.setenv("RH_TRACE_FILE", str(trace_file))
+    run("echo hello", cwd=tmp_path)
+    cmds = ["echo foo", "python -c 'import sys; sys.exit(1)'"]
+    util.run_many(cmds, max_concurrency=2, check=False)
+
+    records = [json.loads(line) for line in trace_file.read_text(encoding="utf-8").splitlines()]
+    assert [r["command"] for r in records[:1]] == ["echo hello"]
+    assert records[0]["cwd"] == str(tmp_path)
+    assert records[0]["output_bytes"] == len("hello\n")
+    assert sorted(r["returncode"] for r in records) == [0, 0, 1]
+
+    text = (tmp_path / "trace.trace.json").read_text(encoding="utf-8")
+    events = json.loads(text.rstrip().rstrip(",") + "]")
+    assert len(events) == 3
+    assert all(e["ph"] == "X" for e in events)
+    assert {e["tid"] for e in events[1:]} == {0, 1}
+
+    # Commands that time out are recorded with the output seen so far.
+    cmd = "echo partial && sleep 30"
+    with pytest.raises(tee.CommandTimeoutError):
+        run(cmd, timeout=3)
+    record = json.loads(trace_file.read_text(encoding="utf-8").splitlines()[-1])
+    assert record["command"] == cmd
+    assert record["output_bytes"] == len("partial\n")
+    assert record["returncode"] is None or record["returncode"] < 0
+
+
+def test_run_timeout(monkeypatch):
+    cmd = "echo partial && sleep 30"
+    start = time.time()
+    with pytest.raises(tee.CommandTimeoutError) as e:
+        run(cmd, timeout=3)
+    assert "partial" in e.value.output
+    assert time.time() - start < 10
+
+    # Commands that ignore SIGTERM get killed after the grace period.
+    cmd = 'python -c "import signal, time; signal.signal(signal.SIGTERM, signal.SIG_IGN); time.sleep(30)"'
+    start = time.time()
+    with pytest.raises(tee.CommandTimeoutError):
+        tee.run(cmd, timeout=0.5, grace_period=0.5)
+    assert time.time() - start < 10
+
+    monkeypatch.setenv("RH_COMMAND_TIMEOUT", "0.5")
+    with pytest.raises(TimeoutExpired):
+        util.run_many(["sleep 30", "echo hello"], max_concurrency=2)
+
+    # The Windows code path honors the global timeout too.
+    with pytest.raises(tee.CommandTimeoutError):
+        util._run_win("sleep 30", grace_period=0.5, shell=False)
+
+
+@pytest.mark.skipif(os.name == "nt", reason="POSIX signals")
+def test_run_interrupt(tmp_path):
+    # Commands with a timeout stay in our session, and are stopped when we
+    # get a Ctrl-C, which does not reach their process group.
+    child = "import os, time; print(os.getpid(), os.getsid(0), flush=True); time.sleep(37)"
+    script = tmp_path / "script.py"
+    script.write_text(
+        "from jupyter_releaser import util\n"
+        f"util.run({f'python -c {child!r}'!r}, timeout=100, grace_period=1)\n",
+        encoding="utf-8",
+    )
+    cmd = [sys.executable, str(script)]
+    with subprocess.Popen(cmd, stderr=subprocess.PIPE, text=True) as proc:  # noqa: S603
+        assert proc.stderr is not None
+        pid, sid = (int(value) for value in proc.stderr.readline().split())
+        assert sid == os.getsid(0)
+        assert os.getpgid(pid) == pid
+        proc.send_signal(signal.SIGINT)
+        proc.wait(timeout=30)
+    with pytest.raises(ProcessLookupError):
+        os.kill(pid, 0)
+
+
+def test_git_query_cache(git_repo):
+    hits = util.git_cache_stats["hits"]
+    assert util.get_branch() == "bar"
+    assert util.get_branch() == "bar"
+    assert util.git_cache_stats["hits"] == hits + 1
+
+    # Changes made outside of util.run are picked up from the repo state.
+    subprocess.run(["git", "checkout", "-q", "foo"], check=True)  # noqa: S603, S607
+    assert util.get_branch() == "foo"
+    sha = util.get_head_sha()
+    (git_repo / "new.txt").write_text("hello", encoding="utf-8")
+    subprocess.run(["git", "add", "new.txt"], check=True)  # noqa: S603, S607
+    subprocess.run(["git", "commit", "-q", "-m", "new"], check=True)  # noqa: S603, S607
+    assert util.get_head_sha() != sha
+
+    # Changes made with util.run invalidate the cache.
+    run("git checkout bar")
+    assert util.get_branch() == "bar"
+    assert util._changes_git_state("git --no-pager tag --merged bar") is False
+    assert util._changes_git_state("git tag v1.0") is True
@@ -151,6 +151,23 @@ src = "package.json"
 search = '"version": "{current_version}"'
 """
 
+TBUMP_PY_TEMPLATE = r"""
+[version]
+current = "0.0.2"
+regex = '''
+  (?P<major>\d+)\.(?P<minor>\d+)\.(?P<patch>\d+)
+  ((?P<channel>a|b|rc|.dev)(?P<release>\d+))?
+'''
+
+[git]
+message_template = "Bump to {new_version}"
+tag_template = "v{new_version}"
+
+[[file]]
+src = "foo.py"
+search = '__version__ = "{current_version}"'
+"""
+
 MANIFEST_TEMPLATE = """
 include *.md
 include *.toml